@@ -0,0 +1,342 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import collections
+import PyPDF2
+import numpy as np
+
+from PIL import Image
+from PyPDF2.generic import ContentStream
+from reportlab.pdfgen import canvas
+from reportlab import rl_config
+
+from Main import process_batch, size, image_dpi, image_quality, output_profile
+from Extract import process_pdf, cache_path, search_terms
+from Images import resize_image, split_image, is_uv_image, OverviewTiles
+import Report
+
+from Report import ReportGenerator, apply_profile, profile_applied, font_files, asset_images, output_profiles
+from Template import default_template, load_template, compile_template, render_plan
+
+# Requirements as Main.py, synthetic sessions & assets stand in for real scans so results compare between versions
+
+
+# The fonts are stood in for by the Vera font bundled with ReportLab
+def create_assets(asset_folder):
+    os.makedirs(asset_folder, exist_ok=True)
+    vera = os.path.join(os.path.dirname(rl_config.__file__), "fonts", "Vera.ttf")
+    for file in font_files.values():
+        shutil.copy(vera, asset_folder + file)
+    for file in asset_images:
+        image = Image.fromarray(noise_frame((600, 400), (40, 130, 160)))
+        if file.endswith(".png"):
+            image.putalpha(160)
+        image.save(asset_folder + file)
+
+
+# A gradient of the colour with sensor like noise, so it compresses like a photo rather than a flat colour
+def noise_frame(frame_size, colour, seed=0):
+    width, height = frame_size
+    rng = np.random.default_rng(seed)
+    shade = np.linspace(0.8, 1.1, height)[:, None, None]
+    frame = np.array(colour)[None, None, :] * shade + rng.normal(0, 6, (height, width, 3))
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+# Regular & UV frames at the camera size plus the overview composite, created once & copied into each session
+def create_frames(frame_folder):
+    os.makedirs(frame_folder, exist_ok=True)
+    regular = noise_frame(size, (215, 170, 150), seed=1)
+    # The chin rest is white in the regular images & black in the UV image
+    regular[-60:] = 250
+    uv = noise_frame(size, (50, 45, 90), seed=2)
+    uv[-60:] = 5
+    Image.fromarray(regular).save(os.path.join(frame_folder, "regular.jpg"), quality=90)
+    Image.fromarray(uv).save(os.path.join(frame_folder, "uv.jpg"), quality=90)
+
+    # 4 x 2 sections alternating between the regular & UV frame
+    tile_size = (size[0] // 4, size[1] // 4)
+    overview = Image.new("RGB", (tile_size[0] * 4, tile_size[1] * 2))
+    for i in range(4):
+        for j in range(2):
+            frame = Image.fromarray(uv if (i + j) % 2 else regular).resize(tile_size)
+            overview.paste(frame, (i * tile_size[0], j * tile_size[1]))
+    overview.save(os.path.join(frame_folder, "overview.jpg"), quality=90)
+
+
+# A scanner like PDF with the name, date & each search term value
+def create_session_pdf(pdf_path, name, date, seed=0):
+    c = canvas.Canvas(pdf_path)
+    c.drawString(50, 800, f"face.{name} .")
+    c.drawString(50, 780, f"session: {date} analysis")
+    c.showPage()
+    for i, search_term in enumerate(search_terms):
+        c.drawString(50, 800 - 20 * i, f"{search_term} ({(seed * 7 + i * 13) % 90 + 5})")
+    c.showPage()
+    c.drawString(50, 800, "Notes")
+    c.save()
+
+
+def create_session(session_folder, frame_folder, index):
+    os.makedirs(session_folder, exist_ok=True)
+    create_session_pdf(os.path.join(session_folder, "scan.pdf"), f"Patient {index}", "01/02/2024", index)
+    for i, frame in enumerate(["regular", "regular", "uv", "regular"], 1):
+        shutil.copy(os.path.join(frame_folder, frame + ".jpg"), os.path.join(session_folder, f"IMG_{i}.jpg"))
+    shutil.copy(os.path.join(frame_folder, "overview.jpg"), os.path.join(session_folder, "IMG_overview.jpg"))
+
+
+def create_batch(batch_folder, frame_folder, sessions):
+    shutil.rmtree(batch_folder, ignore_errors=True)
+    for index in range(sessions):
+        create_session(os.path.join(batch_folder, f"session_{index}"), frame_folder, index)
+
+
+def summarise(times):
+    return {
+        "runs": len(times),
+        "mean": statistics.mean(times),
+        "median": statistics.median(times),
+        "min": min(times),
+        "max": max(times),
+    }
+
+
+def timed(times, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    times.append(time.perf_counter() - start)
+    return result
+
+
+# Time each stage of a single session on its own
+def benchmark_stages(work_folder, frame_folder, asset_folder, repeats):
+    stages = {name: [] for name in ["process_pdf", "process_pdf_cached", "resize_image", "is_uv_image",
+                                    "split_image", "compile_template", "render", "save_report"]}
+    session_folder = os.path.join(work_folder, "stage_session")
+    output_folder = os.path.join(work_folder, "stage_output", "")
+    create_session(session_folder, frame_folder, 0)
+    os.makedirs(output_folder, exist_ok=True)
+    pdf = os.path.join(session_folder, "scan.pdf")
+
+    for _ in range(repeats):
+        if os.path.exists(cache_path(pdf)):
+            os.remove(cache_path(pdf))
+        data = timed(stages["process_pdf"], process_pdf, pdf)
+        timed(stages["process_pdf_cached"], process_pdf, pdf)
+
+        images = []
+        for i in range(1, 5):
+            images.append(timed(stages["resize_image"], resize_image, os.path.join(session_folder, f"IMG_{i}.jpg"),
+                                output_folder + f"Image_{i}.jpg", size))
+        with Image.open(images[0].path) as image:
+            image.load()
+            timed(stages["is_uv_image"], is_uv_image, image)
+        timed(stages["split_image"], split_image, os.path.join(session_folder, "IMG_overview.jpg"), output_folder)
+
+        # The asset images are prepared by compiling, for the profile the report is rendered with
+        apply_profile(output_profile)
+        timed(stages["compile_template"], compile_template.__wrapped__, default_template, asset_folder, None)
+        plan = load_template(default_template, asset_folder)
+        report = ReportGenerator(None, asset_folder, image_dpi, image_quality, output_profile)
+        timed(stages["render"], render_plan, report, plan, data, images,
+              OverviewTiles(os.path.join(session_folder, "IMG_overview.jpg"), output_folder))
+        pdf_data = timed(stages["save_report"], report.save_report)
+
+    return {name: summarise(times) for name, times in stages.items()}, describe_report(pdf_data)
+
+
+# Size of the report & the number of each operator in the content of its pages & forms
+def describe_report(pdf_data):
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_data))
+    streams = [page.get_contents() for page in reader.pages]
+    forms = set()
+    for page in reader.pages:
+        for reference in page["/Resources"].get_object().get("/XObject", {}).get_object().values():
+            xobject = reference.get_object()
+            if xobject["/Subtype"] == "/Form" and reference.idnum not in forms:
+                forms.add(reference.idnum)
+                streams.append(xobject)
+
+    operators = collections.Counter()
+    content_bytes = 0
+    for stream in streams:
+        content_bytes += len(stream.get_data())
+        operators.update(operator.decode() for _, operator in ContentStream(stream, reader).operations)
+    return {
+        "bytes": len(pdf_data),
+        "pages": len(reader.pages),
+        "content_bytes": content_bytes,
+        "operator_count": sum(operators.values()),
+        "operators": dict(operators.most_common()),
+    }
+
+
+# Size of the report & the time to render & save it with each output profile
+def benchmark_profiles(work_folder, frame_folder, asset_folder, repeats):
+    session_folder = os.path.join(work_folder, "profile_session")
+    output_folder = os.path.join(work_folder, "profile_output", "")
+    create_session(session_folder, frame_folder, 0)
+    os.makedirs(output_folder, exist_ok=True)
+    data = process_pdf(os.path.join(session_folder, "scan.pdf"))
+    images = [resize_image(os.path.join(session_folder, f"IMG_{i}.jpg"), output_folder + f"Image_{i}.jpg", size)
+              for i in range(1, 5)]
+    tiles = OverviewTiles(os.path.join(session_folder, "IMG_overview.jpg"), output_folder)
+    plan = load_template(default_template, asset_folder)
+
+    results = {}
+    for name in output_profiles:
+        # Saved as ReportLab writes it without pikepdf or qpdf, its size & time would only repeat another profile's
+        if not profile_applied(name):
+            results[name] = {"applied": False}
+            print(f"Profile {name}: skipped, needs pikepdf or qpdf")
+            continue
+        times = []
+        # The first report of each profile encodes the images, the rest reuse them as the reports of a worker do
+        for _ in range(repeats + 1):
+            start = time.perf_counter()
+            report = ReportGenerator(None, asset_folder, image_dpi, image_quality, name)
+            render_plan(report, plan, data, images, tiles)
+            pdf_data = report.save_report()
+            times.append(time.perf_counter() - start)
+        results[name] = {**summarise(times[1:]), "first": times[0], "bytes": len(pdf_data), "applied": True}
+        print(f"Profile {name}: {len(pdf_data)} bytes in {results[name]['median'] * 1000:.1f}ms "
+              f"({times[0] * 1000:.1f}ms encoding the images)")
+    return results
+
+
+# Remove everything exported but the assets, so no session finds the manifest of an earlier run's report to reuse
+def clear_exports(export_root):
+    if not os.path.exists(export_root):
+        return
+    for entry in os.scandir(export_root):
+        if entry.name == "Assets":
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+
+# Time whole batches end to end for each batch size & number of workers, each from an export folder of assets only
+def benchmark_batches(work_folder, frame_folder, batch_sizes, worker_counts):
+    batch_folder = os.path.join(work_folder, "batch")
+    export_root = os.path.join(work_folder, "export")
+    results = []
+    for sessions in batch_sizes:
+        for workers in worker_counts:
+            create_batch(batch_folder, frame_folder, sessions)
+            clear_exports(export_root)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                completed, failed = process_batch(batch_folder, export_root, size, workers)
+            elapsed = time.perf_counter() - start
+            results.append({
+                "sessions": sessions,
+                "workers": workers,
+                "completed": len(completed),
+                "failed": len(failed),
+                "elapsed": elapsed,
+                "reports_per_hour": len(completed) / elapsed * 3600,
+            })
+            print(f"Batch of {sessions} with {workers} workers: {elapsed:.2f}s, "
+                  f"{results[-1]['reports_per_hour']:.0f} reports/hour")
+    return results
+
+
+def run_benchmark(work_folder, batch_sizes, worker_counts, repeats):
+    asset_folder = os.path.join(work_folder, "export", "Assets", "")
+    frame_folder = os.path.join(work_folder, "frames")
+    create_assets(asset_folder)
+    create_frames(frame_folder)
+    stages, report = benchmark_stages(work_folder, frame_folder, asset_folder, repeats)
+    profiles = benchmark_profiles(work_folder, frame_folder, asset_folder, repeats)
+
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "stages": stages,
+        "report": report,
+        # Tool the profiles that compress again, pack or linearize were saved with, they're saved as ReportLab wrote
+        # them when there isn't one
+        "pdf_tool": "pikepdf" if Report.pikepdf is not None else "qpdf" if Report.qpdf is not None else None,
+        "profiles": profiles,
+        "batches": benchmark_batches(work_folder, frame_folder, batch_sizes, worker_counts),
+    }
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+# Print the change of each stage's median time & each batch's throughput against earlier results
+def compare_results(previous, results):
+    print(f"--- COMPARED TO {previous.get('commit')} ({previous.get('created')}) ---")
+    for name, stage in results["stages"].items():
+        if name in previous["stages"]:
+            before = previous["stages"][name]["median"]
+            print(f"{name}: {before * 1000:.1f}ms -> {stage['median'] * 1000:.1f}ms "
+                  f"({(stage['median'] - before) / before * 100:+.0f}%)")
+    if "report" in previous:
+        for key in ["bytes", "content_bytes", "operator_count"]:
+            print(f"Report {key}: {previous['report'][key]} -> {results['report'][key]}")
+    for name, profile in results["profiles"].items():
+        before = previous.get("profiles", {}).get(name)
+        if before is not None and before.get("applied", True) and profile["applied"]:
+            print(f"Profile {name}: {before['bytes']} -> {profile['bytes']} bytes, "
+                  f"{before['median'] * 1000:.1f}ms -> {profile['median'] * 1000:.1f}ms")
+    earlier = {(batch["sessions"], batch["workers"]): batch for batch in previous["batches"]}
+    for batch in results["batches"]:
+        before = earlier.get((batch["sessions"], batch["workers"]))
+        if before is not None:
+            print(f"Batch of {batch['sessions']} with {batch['workers']} workers: "
+                  f"{before['reports_per_hour']:.0f} -> {batch['reports_per_hour']:.0f} reports/hour")
+
+
+# --- CONFIG --- #
+
+# Folder the synthetic sessions are created & processed in, it is deleted first
+benchmark_folder = os.path.join(tempfile.gettempdir(), "reportgen_benchmark")
+# Number of sessions in each batch & number of workers to process each with
+batch_sizes = [1, 4]
+worker_counts = sorted({1, os.cpu_count()})
+# Number of times each stage is timed
+repeats = 3
+# File the results are saved to & the results of an earlier version to compare them with (None for no comparison)
+results_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results.json")
+compare_file = None
+
+# --- PROGRAM --- #
+
+if __name__ == '__main__':
+
+    shutil.rmtree(benchmark_folder, ignore_errors=True)
+    results = run_benchmark(benchmark_folder, batch_sizes, worker_counts, repeats)
+
+    print("--- STAGES (median) ---")
+    for name, stage in results["stages"].items():
+        print(f"{name}: {stage['median'] * 1000:.1f}ms")
+    print(f"Report: {results['report']['bytes']} bytes, {results['report']['operator_count']} content operators")
+
+    with open(results_file, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Saved results to {results_file}")
+
+    if compare_file is not None:
+        with open(compare_file, 'r') as file:
+            compare_results(json.load(file), results)
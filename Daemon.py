@@ -0,0 +1,200 @@
+import os
+import time
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from Main import check_files, escape_file_path, find_sessions, preload_worker, run_session, session_memory, \
+    MemoryBudget, report_export_folder, size, worker_count, memory_budget, output_profile, metrics_file, \
+    prometheus_file
+from Instrument import configure, update_prometheus
+
+# Requirements as Main.py, watchdog is optional & only used to notice new files sooner than the next poll
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+
+# Wakes the inbox scan as soon as anything in the inbox changes
+if Observer is not None:
+    class WakeHandler(FileSystemEventHandler):
+
+        def __init__(self, wake):
+            self.wake = wake
+
+        def on_any_event(self, event):
+            self.wake.set()
+
+
+# Names, sizes & modification times of the files in a session folder, unchanged once the scanner is done writing
+def folder_signature(session_folder):
+    return tuple(sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                        for entry in os.scandir(session_folder) if entry.is_file()))
+
+
+# A session is complete once it has the photos & PDF check_files requires
+def is_complete(session_folder):
+    try:
+        check_files(session_folder)
+    except ValueError:
+        return False
+    return True
+
+
+# Worker processes kept warm between reports
+def create_executor(export_root, workers):
+    return ProcessPoolExecutor(max_workers=workers, initializer=preload_worker,
+                               initargs=(os.path.join(export_root, "Assets", ""), output_profile))
+
+
+# Watch the inbox for session folders & process each once complete, using worker processes kept warm between reports
+# A complete session waits until its images fit in the memory budget (None for no limit)
+def watch_inbox(inbox_folder, export_root, size, workers, poll_interval=2.0, settle_time=1.0, stop=None,
+                memory_budget=None):
+    if stop is None:
+        stop = threading.Event()
+
+    wake = threading.Event()
+    observer = None
+    if Observer is not None:
+        observer = Observer()
+        observer.schedule(WakeHandler(wake), inbox_folder, recursive=True)
+        observer.start()
+
+    # Session folder -> (signature, time it was first seen with that signature)
+    pending = {}
+    # Session folder -> (future, time it was handed to a worker, signature, estimated memory)
+    running = {}
+    # Session folder -> signature it failed with, it is tried again only once its files change
+    failed = {}
+    # Session folders that were running when the worker processes stopped
+    interrupted = set()
+
+    print(f"Watching '{inbox_folder}' for sessions ({'events' if observer else 'polling'}, {workers} workers)")
+    executor = create_executor(export_root, workers)
+    budget = MemoryBudget(memory_budget)
+    try:
+        while not stop.is_set():
+            if collect_finished(running, failed, budget, interrupted):
+                executor = restart_executor(executor, running, budget, export_root, workers)
+            now = time.monotonic()
+
+            for session_folder in find_sessions(inbox_folder):
+                if session_folder in running:
+                    continue
+                try:
+                    signature = folder_signature(session_folder)
+                except OSError:
+                    # Removed while being read
+                    continue
+                if failed.get(session_folder) == signature:
+                    continue
+                failed.pop(session_folder, None)
+
+                # Wait for the files to stop changing so a session still being written isn't picked up
+                if pending.get(session_folder, (None,))[0] != signature:
+                    pending[session_folder] = (signature, now)
+                elif now - pending[session_folder][1] >= settle_time and is_complete(session_folder):
+                    # Otherwise it stays pending & is tried again once a report is finished
+                    try:
+                        memory = session_memory(session_folder)
+                    except OSError:
+                        # Removed since it was scanned
+                        continue
+                    if not budget.try_acquire(memory):
+                        continue
+                    try:
+                        future = executor.submit(run_session, session_folder, export_root, size)
+                    except BrokenProcessPool:
+                        # Stays pending for the new worker processes
+                        budget.release(memory)
+                        executor = restart_executor(executor, running, budget, export_root, workers)
+                        continue
+                    del pending[session_folder]
+                    print(f"Session ready: {session_folder}")
+                    future.add_done_callback(lambda _: wake.set())
+                    running[session_folder] = (future, now, signature, memory)
+
+            # Forget sessions that have been removed
+            for session_folder in [folder for folder in pending if not os.path.isdir(folder)]:
+                del pending[session_folder]
+
+            # A pending session is rechecked once it has had time to settle, otherwise at the next poll or as soon as
+            # a file changes or a report is finished
+            wake.wait(min(poll_interval, settle_time) if pending else poll_interval)
+            wake.clear()
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        executor.shutdown(wait=True)
+        collect_finished(running, failed, budget, interrupted)
+
+
+# A worker process that stops, e.g. killed for running out of memory, breaks the whole pool, so it is replaced
+# The sessions still running are forgotten, the next scan of the inbox finds them pending again
+def restart_executor(executor, running, budget, export_root, workers):
+    print("A worker process stopped unexpectedly, starting new worker processes")
+    executor.shutdown(wait=False)
+    for _, _, _, memory in running.values():
+        budget.release(memory)
+    running.clear()
+    return create_executor(export_root, workers)
+
+
+# Returns whether a session was stopped by the worker processes stopping
+def collect_finished(running, failed, budget, interrupted):
+    broken = False
+    for session_folder, (future, submitted, signature, memory) in list(running.items()):
+        if not future.done():
+            continue
+        del running[session_folder]
+        budget.release(memory)
+        try:
+            export_pdf, seconds = future.result()
+        except BrokenProcessPool:
+            broken = True
+            # Tried again once, a session running each time the workers stop is likely stopping them
+            if session_folder in interrupted:
+                failed[session_folder] = signature
+                print(f"Error: {session_folder}: the worker process stopped twice while processing it")
+            else:
+                interrupted.add(session_folder)
+        except Exception as e:
+            failed[session_folder] = signature
+            print(f"Error: {session_folder}: {e}")
+        else:
+            interrupted.discard(session_folder)
+            print(f"Created report {export_pdf} in {seconds:.2f}s "
+                  f"({time.monotonic() - submitted:.2f}s after the session was complete)")
+            # Every file has been moved to the export folder, remove the now empty session folder
+            try:
+                os.rmdir(session_folder)
+            except OSError:
+                pass
+        update_prometheus()
+    return broken
+
+
+# --- CONFIG --- #
+
+# Folder the scanner saves each session into, as one folder per session
+inbox_folder_path = r'C:\Users\Owner\Downloads\Inbox'
+# Seconds between scans of the inbox when watchdog isn't installed
+poll_interval = 2.0
+# Seconds a session's files must stay unchanged before it is processed
+settle_time = 1.0
+
+# --- PROGRAM --- #
+
+if __name__ == '__main__':
+
+    configure(metrics_file, prometheus_file)
+    try:
+        watch_inbox(escape_file_path(inbox_folder_path), escape_file_path(report_export_folder), size, worker_count,
+                    poll_interval, settle_time, memory_budget=memory_budget)
+    except KeyboardInterrupt:
+        print("Stopped watching the inbox.")
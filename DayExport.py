@@ -0,0 +1,81 @@
+import os
+import glob
+
+from Main import escape_file_path, rebuild_session, report_export_folder, size, image_dpi, image_quality, \
+    output_profile, metrics_file, prometheus_file
+from Report import ReportGenerator
+from Extract import process_pdf
+from Images import OverviewTiles, PreparedImage
+from Template import default_template, load_template, render_plan
+from Instrument import configure, span, update_prometheus
+from Manifest import load_manifest, manifest_current, reusable_tiles
+
+# Requirements as Main.py
+
+
+# The exported sessions of a clinic day, by the date as it's formatted in the export folders
+def find_day_sessions(export_root, day):
+    return sorted(session_export for session_export in glob.glob(os.path.join(export_root, "*", day))
+                  if os.path.exists(os.path.join(session_export, "files", "raw_report.pdf")))
+
+
+# Render the reports of the exported sessions one after another into a single PDF with a bookmark per patient
+# The reports share one document, so the fonts, asset images & static page content are embedded once for all of them
+def export_day(session_exports, export_pdf, export_root, size, template_file=default_template):
+    asset_folder = os.path.join(export_root, "Assets", "")
+    # Created first as compiling the template prepares the asset images for the report's output profile
+    report = ReportGenerator(export_pdf, asset_folder, image_dpi, image_quality, output_profile)
+    plan = load_template(template_file, asset_folder)
+
+    for index, session_export in enumerate(session_exports):
+        # The images & overview sections already prepared are used as the manifest lists them, the session is only
+        # brought up to date first when its files have changed since
+        export_folder = os.path.join(session_export, "files", "")
+        manifest = load_manifest(export_folder)
+        if not manifest_current(manifest, export_folder, size):
+            rebuild_session(session_export, export_root, size)
+            manifest = load_manifest(export_folder)
+        data = process_pdf(export_folder + "raw_report.pdf")
+
+        # The manifest lists the images in the order of their photo pages
+        images = [PreparedImage(export_folder + name, image["is_uv"]) for name, image in manifest["images"].items()]
+        tiles = OverviewTiles(export_folder + "Raw_Image_Overview.jpg", export_folder)
+        tiles.paths.update(reusable_tiles(manifest, export_folder, manifest["overview"]["sha256"]))
+
+        # Each report starts on a new page, its pages numbered from 1 again by the template
+        if index:
+            report.add_page()
+        report.add_bookmark(f"session_{index}", f"{data.name} ({data.date})")
+        with span("render_day_report", session=session_export):
+            render_plan(report, plan, data, images, tiles)
+
+    return report.save_report()
+
+
+# --- CONFIG --- #
+
+# Date of the clinic day to export, as the session folders within the export folder are named e.g. 12_03_2024
+clinic_day = '12_03_2024'
+
+# --- PROGRAM --- #
+
+if __name__ == '__main__':
+
+    try:
+
+        configure(metrics_file, prometheus_file)
+
+        escaped_export = escape_file_path(report_export_folder)
+        day_sessions = find_day_sessions(escaped_export, clinic_day)
+        if not day_sessions:
+            raise ValueError(f"No exported sessions found for {clinic_day}.")
+
+        day_pdf = os.path.join(escaped_export, clinic_day + "_Reports.pdf")
+        export_day(day_sessions, day_pdf, escaped_export, size)
+        print(f"Saved the {len(day_sessions)} reports of {clinic_day} to {day_pdf}")
+
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    finally:
+        update_prometheus()
@@ -0,0 +1,177 @@
+import io
+import os
+import re
+import json
+import hashlib
+import PyPDF2
+
+from dataclasses import dataclass, asdict
+from decimal import Decimal, InvalidOperation
+
+from Instrument import span
+
+
+# Values to collect from the PDF and the field of ReportData each is stored in
+search_terms = {
+    "Spots": "spots",
+    "Wrinkles": "wrinkles",
+    "Texture": "texture",
+    "Pores": "pores",
+    "UV Spots": "uv_spots",
+    "Brown Spots": "brown_spots",
+    "Red Areas": "red_areas",
+    "Porphyrins": "porphyrins",
+}
+
+# Matches every metric "<Search Term> (<value>)" at the start of a line, the name and the date in one pass
+report_pattern = re.compile(
+    r"^\s*(?P<term>" + "|".join(re.escape(term) for term in search_terms) + r")\s*\((?P<value>\d+\.*\d*)\)"
+    r"|face\.(?P<name>.+?)(?=\s+\.)"
+    r"|session:\s+(?P<date>[\d/]+)(?=\s)",
+    re.MULTILINE
+)
+
+# Version of the sidecar cache format, increase when ReportData or the extraction changes
+cache_version = 1
+
+
+@dataclass(frozen=True)
+class ReportData:
+    name: str
+    date: str
+    spots: Decimal
+    wrinkles: Decimal
+    texture: Decimal
+    pores: Decimal
+    uv_spots: Decimal
+    brown_spots: Decimal
+    red_areas: Decimal
+    porphyrins: Decimal
+
+
+# Function to process the PDF file
+def process_pdf(pdf_path):
+    print(f"Processing PDF: {pdf_path}")
+
+    with span("process_pdf", pdf=pdf_path) as labels:
+        with open(pdf_path, 'rb') as file:
+            content = file.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        # Use the values parsed on a previous run of this same PDF if there are any
+        data = load_cached_data(pdf_path, content_hash)
+        labels["cached"] = data is not None
+        if data is None:
+            data = extract_data_from_pdf(io.BytesIO(content))
+            save_cached_data(pdf_path, content_hash, data)
+
+    return data
+
+
+# Collect the name, date & each search term value from the report text
+def extract_report_data(text):
+    return build_report_data(scan_report_text(text))
+
+
+# Read the PDF a page at a time, stopping once the name, date & every search term have been found
+def extract_data_from_pdf(file):
+    pdf_reader = PyPDF2.PdfReader(file)
+
+    matches = {}
+    # Each page is scanned after the last line read before it, as a match at the end of a page e.g. the name may only
+    # be complete with the start of the next, the matches already counted are known by where they start in that line
+    carry = ""
+    counted = set()
+    for page in pdf_reader.pages:
+        text = carry + page.extract_text()
+        last_line = text.rstrip().rfind("\n") + 1
+        found = set()
+        for start, key, value in report_matches(text):
+            if start >= last_line:
+                found.add(start - last_line)
+            if start < len(carry) and start in counted:
+                continue
+            matches.setdefault(key, []).append(value)
+        carry, counted = text[last_line:], found
+        if all(key in matches for key in [*search_terms, "name", "date"]):
+            break
+
+    return build_report_data(matches)
+
+
+def build_report_data(matches):
+    values = {}
+    for search_term, field in search_terms.items():
+        value = get_single_match(matches, search_term, f"Multiple '{search_term}' data found. Ambiguous result.",
+                                 f"None of '{search_term}' data found.")
+        try:
+            values[field] = Decimal(value)
+        except InvalidOperation:
+            raise ValueError(f"Invalid '{search_term}' data found: {value}")
+
+    values["date"] = get_single_match(matches, "date", "Multiple dates found. Ambiguous result.", "No date found.")
+    values["name"] = get_single_match(matches, "name", "Multiple names found. Ambiguous result.", "No name found.")
+
+    return ReportData(**values)
+
+
+# Find all occurrences of each search term, the name and the date, in a single pass over the text
+def scan_report_text(text):
+    matches = {}
+    for _, key, value in report_matches(text):
+        matches.setdefault(key, []).append(value)
+    return matches
+
+
+# Where each match starts in the text, what it is & its value
+def report_matches(text):
+    for match in report_pattern.finditer(text):
+        if match.group("term") is not None:
+            yield match.start(), match.group("term"), match.group("value")
+        elif match.group("name") is not None:
+            yield match.start(), "name", match.group("name")
+        else:
+            yield match.start(), "date", match.group("date")
+
+
+def get_single_match(matches, key, multiple_error, missing_error):
+    found = matches.get(key, [])
+    if len(found) > 1:
+        raise ValueError(multiple_error)
+    elif found:
+        return found[0]
+    else:
+        raise ValueError(missing_error)
+
+
+# Sidecar file the parsed values of a PDF are cached in
+def cache_path(pdf_path):
+    return os.path.splitext(pdf_path)[0] + ".cache.json"
+
+
+def load_cached_data(pdf_path, content_hash):
+    try:
+        with open(cache_path(pdf_path), 'r') as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    # Only use the cache if it was created from this exact PDF, a cache that can't be read is parsed again
+    try:
+        if cached.get("version") != cache_version or cached.get("sha256") != content_hash:
+            return None
+        values = cached["data"]
+        for field in search_terms.values():
+            values[field] = Decimal(values[field])
+        return ReportData(**values)
+    except (AttributeError, KeyError, TypeError, InvalidOperation):
+        return None
+
+
+def save_cached_data(pdf_path, content_hash, data):
+    values = {field: str(value) for field, value in asdict(data).items()}
+    try:
+        with open(cache_path(pdf_path), 'w') as file:
+            json.dump({"version": cache_version, "sha256": content_hash, "data": values}, file, indent=2)
+    except OSError as e:
+        print(f"Could not cache PDF values for {pdf_path}: {e}")
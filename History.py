@@ -0,0 +1,167 @@
+import os
+import glob
+import sqlite3
+
+from contextlib import closing
+from datetime import datetime
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
+
+from Extract import ReportData, process_pdf, search_terms
+from Instrument import span
+
+# Requirements as Main.py, sqlite3 is part of the standard library
+
+
+# Saved in the export folder, every session's values by patient & date
+history_name = "history.sqlite3"
+
+# Columns of the search term values, as the fields of ReportData
+metric_fields = list(search_terms.values())
+
+
+# The values are kept as the text they were parsed from, so they're read back as the exact same Decimals
+# A NUMERIC column would store them as numbers, e.g. 12.50 as 12.5
+sessions_table = f"""
+    CREATE TABLE IF NOT EXISTS sessions (
+        patient TEXT NOT NULL,
+        date TEXT NOT NULL,
+        name TEXT NOT NULL,
+        report_date TEXT NOT NULL,
+        {", ".join(f"{field} TEXT" for field in metric_fields)},
+        session_folder TEXT,
+        recorded TEXT NOT NULL,
+        PRIMARY KEY (patient, date)
+    )"""
+
+
+def open_history(export_root):
+    connection = sqlite3.connect(os.path.join(export_root, history_name), timeout=30)
+    # Worker processes record their sessions at the same time, readers aren't blocked while one writes
+    connection.execute("PRAGMA journal_mode=WAL")
+    with connection:
+        # A history created with NUMERIC values is moved to a table of text values, backfill_history records the
+        # values as exactly as they were reported again
+        column_types = {row[1]: row[2] for row in connection.execute("PRAGMA table_info(sessions)")}
+        if column_types.get(metric_fields[0]) == "NUMERIC":
+            connection.execute("ALTER TABLE sessions RENAME TO sessions_numeric")
+            connection.execute("DROP INDEX IF EXISTS sessions_by_date")
+            connection.execute(sessions_table)
+            connection.execute("INSERT INTO sessions SELECT * FROM sessions_numeric")
+            connection.execute("DROP TABLE sessions_numeric")
+        connection.execute(sessions_table)
+        connection.execute("CREATE INDEX IF NOT EXISTS sessions_by_date ON sessions (date)")
+    return connection
+
+
+# The patient as the export folders are named (format_filename), so the history & the folder tree agree on who is who
+def patient_key(name):
+    return name.replace('/', '_').replace(' ', '_')
+
+
+# Reports give the date as day/month/year, it's stored as YYYY-MM-DD so dates sort & compare in order
+# A date that can't be read is kept as it is
+def iso_date(date):
+    try:
+        return datetime.strptime(date, "%d/%m/%Y").date().isoformat()
+    except ValueError:
+        return date
+
+
+def session_row(data, session_folder):
+    return (patient_key(data.name), iso_date(data.date), data.name, data.date,
+            *[str(getattr(data, field)) for field in metric_fields], session_folder,
+            datetime.now().isoformat(timespec="seconds"))
+
+
+def insert_sessions(connection, rows):
+    columns = ["patient", "date", "name", "report_date", *metric_fields, "session_folder", "recorded"]
+    with connection:
+        connection.executemany(
+            f"INSERT OR REPLACE INTO sessions ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+
+
+# Record the values of a session, replacing those recorded before for the same patient & date
+def record_session(export_root, data, session_export):
+    try:
+        with span("record_session"), closing(open_history(export_root)) as connection:
+            insert_sessions(connection, [session_row(data, os.path.relpath(session_export, export_root))])
+    except sqlite3.Error as e:
+        print(f"Could not record the session {session_export} in the history: {e}")
+
+
+def row_data(row):
+    name, report_date, *values = row
+    return ReportData(name, report_date, *[Decimal(str(value)) for value in values])
+
+
+# Every session of the patient oldest first, or only those before the date given as in the report e.g. 12/03/2024
+def patient_history(export_root, name, before=None):
+    query = f"SELECT name, report_date, {', '.join(metric_fields)} FROM sessions WHERE patient = ?"
+    parameters = [patient_key(name)]
+    if before is not None:
+        query += " AND date < ?"
+        parameters.append(iso_date(before))
+    with closing(open_history(export_root)) as connection:
+        return [row_data(row) for row in connection.execute(query + " ORDER BY date", parameters)]
+
+
+# Number of sessions & the mean, lowest & highest of each value over the sessions between the dates (inclusive)
+def cohort_statistics(export_root, start=None, end=None):
+    # Compared as numbers rather than as the text they're stored as
+    columns = ", ".join(f"AVG(CAST({field} AS REAL)), MIN(CAST({field} AS REAL)), MAX(CAST({field} AS REAL))"
+                        for field in metric_fields)
+    conditions = []
+    parameters = []
+    if start is not None:
+        conditions.append("date >= ?")
+        parameters.append(iso_date(start))
+    if end is not None:
+        conditions.append("date <= ?")
+        parameters.append(iso_date(end))
+    query = f"SELECT COUNT(*), COUNT(DISTINCT patient), {columns} FROM sessions"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    with closing(open_history(export_root)) as connection:
+        sessions, patients, *values = connection.execute(query, parameters).fetchone()
+    statistics = {"sessions": sessions, "patients": patients}
+    for i, field in enumerate(metric_fields):
+        statistics[field] = dict(zip(["mean", "min", "max"], values[i * 3:i * 3 + 3]))
+    return statistics
+
+
+# Parse the archived report of every exported session across worker processes & record them all in the history
+# Returns the number of sessions recorded & the reports that couldn't be parsed
+def backfill_history(export_root, workers):
+    pdf_files = sorted(glob.glob(os.path.join(export_root, "*", "*", "files", "raw_report.pdf")))
+    print(f"Found {len(pdf_files)} exported sessions in '{export_root}'")
+
+    rows = []
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(pdf_file, executor.submit(process_pdf, pdf_file)) for pdf_file in pdf_files]
+        for pdf_file, future in futures:
+            try:
+                data = future.result()
+            except Exception as e:
+                failed.append((pdf_file, e))
+                print(f"Error: {pdf_file}: {e}")
+            else:
+                session_export = os.path.dirname(os.path.dirname(pdf_file))
+                rows.append(session_row(data, os.path.relpath(session_export, export_root)))
+
+    # Written in one transaction from this process only
+    with closing(open_history(export_root)) as connection:
+        insert_sessions(connection, rows)
+    return len(rows), failed
+
+
+# --- PROGRAM --- #
+
+if __name__ == '__main__':
+
+    # Main records each session in the history, so its settings are only imported when this is run
+    from Main import escape_file_path, report_export_folder, worker_count
+
+    recorded, failed = backfill_history(escape_file_path(report_export_folder), worker_count)
+    print(f"Recorded {recorded} sessions in the history, {len(failed)} reports could not be read")
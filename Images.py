@@ -0,0 +1,125 @@
+import shutil
+import subprocess
+import numpy as np
+
+from dataclasses import dataclass
+from PIL import Image
+
+from Instrument import span
+
+
+# Region of the resized image kept for the photo pages (left, upper, right, lower)
+crop_box = (155, 0, 2564, 3508)
+# Region of the kept image around the centre of the chin rest, used to tell the UV image from the regular images
+chin_rest_box = (1190, 3458, 1290, 3508)
+
+black = np.array((0, 0, 0))
+white = np.array((255, 255, 255))
+
+
+# A resized image ready to place in the report
+@dataclass(frozen=True)
+class PreparedImage:
+    path: str
+    is_uv: bool
+
+
+# Bytes Pillow takes to hold the decoded image, read from its header only
+# Pillow keeps images of more than one band at 4 bytes a pixel, so an RGB photo takes a third more than its pixels
+def image_memory(image_path):
+    with Image.open(image_path) as image:
+        return image.width * image.height * (1 if len(image.getbands()) == 1 else 4)
+
+
+def resize_image(input_image_path, output_image_path, size, crop=crop_box):
+    with span("resize_image", image=input_image_path), Image.open(input_image_path) as image:
+        # Decode JPEGs at a reduced scale (1/2, 1/4, 1/8) where that is still no smaller than the target size
+        image.draft(None, size)
+        # Map the crop onto the source so only the kept region is resampled
+        scale_x = image.width / size[0]
+        scale_y = image.height / size[1]
+        box = (crop[0] * scale_x, crop[1] * scale_y, crop[2] * scale_x, crop[3] * scale_y)
+        resized_image = image.resize((crop[2] - crop[0], crop[3] - crop[1]), box=box)
+        resized_image.save(output_image_path)
+
+    return PreparedImage(output_image_path, is_uv_image(resized_image))
+
+
+# The chin rest is black in the UV image and white in the regular images
+def is_uv_image(image, box=chin_rest_box):
+    # Take the median colour of the region so a single noisy pixel can't change the result
+    region = np.asarray(image.crop(box).convert("RGB")).reshape(-1, 3)
+    colour_sample = np.median(region, axis=0)
+
+    # Is the colour closer to white or black
+    return bool(np.linalg.norm(colour_sample - black) < np.linalg.norm(colour_sample - white))
+
+
+# Lossless JPEG transformation tool, tiles are decoded & re-encoded with Pillow when it isn't installed
+jpegtran = shutil.which("jpegtran")
+
+
+# The sections of the overview image, each only cropped out when it is first used
+class OverviewTiles:
+
+    columns: int = 4
+    rows: int = 2
+
+    def __init__(self, overview_path, output_folder):
+        self.overview_path = overview_path
+        self.output_folder = output_folder
+        self.paths = {}
+        self.decoded = None
+        # Read from the overview when the first section is cropped, the overview may still be being archived until then
+        self.width = self.height = self.block_size = None
+
+    def read_header(self):
+        # Read the header only to get the size and the JPEG MCU block size
+        with Image.open(self.overview_path) as img:
+            self.width, self.height = img.size
+            if img.format == "JPEG":
+                self.block_size = (8 * max(layer[1] for layer in img.layer), 8 * max(layer[2] for layer in img.layer))
+
+    # Get the path of section i horizontally & j vertically, creating it if needed
+    def get(self, i, j):
+        if (i, j) not in self.paths:
+            with span("split_image", tile=f"{i}_{j}"):
+                self.paths[(i, j)] = self.crop(i, j)
+        return self.paths[(i, j)]
+
+    def crop(self, i, j):
+        if self.width is None:
+            self.read_header()
+
+        # Calculate the coordinates for cropping the section
+        section_width = self.width // self.columns
+        section_height = self.height // self.rows
+        left = i * section_width
+        upper = j * section_height
+        output_path = self.output_folder + "overview_" + str(i) + "_" + str(j) + ".jpg"
+
+        # Crop in the DCT domain when the section starts on an MCU block, there is then no generation loss
+        if jpegtran is not None and self.block_size is not None \
+                and left % self.block_size[0] == 0 and upper % self.block_size[1] == 0:
+            result = subprocess.run([jpegtran, "-copy", "none",
+                                     "-crop", f"{section_width}x{section_height}+{left}+{upper}",
+                                     "-outfile", output_path, self.overview_path], capture_output=True)
+            if result.returncode == 0:
+                return output_path
+
+        # Otherwise decode the overview once & re-encode the section
+        if self.decoded is None:
+            with Image.open(self.overview_path) as img:
+                img.load()
+                self.decoded = img
+        section = self.decoded.crop((left, upper, left + section_width, upper + section_height))
+        section.save(output_path)
+        return output_path
+
+
+# Split the overview image into all 8 sections
+def split_image(input_image_path, output_image_folder):
+    tiles = OverviewTiles(input_image_path, output_image_folder)
+    for i in range(tiles.columns):  # Number of sections horizontally
+        for j in range(tiles.rows):  # Number of sections vertically
+            tiles.get(i, j)
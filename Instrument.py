@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+
+# Peak memory is read with resource where available, psutil is optional & used on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# JSON lines file every span is appended to by each process, None turns the spans off
+metrics_file = os.environ.get("REPORTGEN_METRICS_FILE") or None
+# Prometheus text format file kept up to date from the metrics file by the process coordinating the workers
+prometheus_file = os.environ.get("REPORTGEN_PROMETHEUS_FILE") or None
+
+write_lock = threading.Lock()
+
+
+def configure(metrics_path=None, prometheus_path=None):
+    global metrics_file, prometheus_file
+    metrics_file = metrics_path
+    prometheus_file = prometheus_path
+    # Worker processes read the files from their environment, they may not start as a copy of this process
+    for name, path in [("REPORTGEN_METRICS_FILE", metrics_path), ("REPORTGEN_PROMETHEUS_FILE", prometheus_path)]:
+        if path is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = path
+
+
+# Highest resident memory of this process so far in bytes, None if it can't be read
+def peak_rss():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in kilobytes except on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, "peak_wset", memory.rss)
+    return None
+
+
+# Record the wall time, CPU time & memory of the block as one JSON line
+# The CPU time is of the calling thread, or of the whole process with process_cpu for a block that runs work on other
+# threads e.g. a session decoding its images on a thread pool
+# The peak RSS is the highest of the process so far, the peak RSS delta how far the block raised it, i.e. the memory
+# the block needed beyond what the process had needed before (0 when it fit in that), shared with any blocks running
+# on other threads at the same time
+# Yields the labels of the span so the block can add to them, e.g. with what it found
+@contextlib.contextmanager
+def span(name, process_cpu=False, **labels):
+    if metrics_file is None:
+        yield labels
+        return
+
+    cpu_time = time.process_time if process_cpu else time.thread_time
+    start = time.perf_counter()
+    cpu_start = cpu_time()
+    peak_start = peak_rss()
+    failed = False
+    try:
+        yield labels
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        peak = peak_rss()
+        record = {
+            "span": name,
+            "wall": time.perf_counter() - start,
+            "cpu": cpu_time() - cpu_start,
+            "peak_rss": peak,
+            "peak_rss_delta": None if peak is None else peak - peak_start,
+            "pid": os.getpid(),
+            "time": time.time(),
+            **labels,
+        }
+        if failed:
+            record["failed"] = True
+        line = json.dumps(record, default=str) + "\n"
+        with write_lock:
+            with open(metrics_file, 'a') as file:
+                file.write(line)
+
+
+# Totals of each span read from the metrics file so far, & how far it has been read
+prometheus_totals = {}
+metrics_offset = 0
+prometheus_lock = threading.Lock()
+
+
+def update_prometheus():
+    if prometheus_file is None or metrics_file is None or not os.path.exists(metrics_file):
+        return
+    with prometheus_lock:
+        write_prometheus()
+
+
+def write_prometheus():
+    global metrics_offset
+    # Only complete lines are read, a worker may be part way through writing the last one
+    with open(metrics_file, 'rb') as file:
+        file.seek(metrics_offset)
+        for line in iter(file.readline, b""):
+            if not line.endswith(b"\n"):
+                break
+            metrics_offset = file.tell()
+            record = json.loads(line)
+            totals = prometheus_totals.setdefault(record["span"], {"count": 0, "wall": 0.0, "cpu": 0.0,
+                                                                   "failed": 0, "peak_rss": 0,
+                                                                   "peak_rss_delta": 0})
+            totals["count"] += 1
+            totals["wall"] += record["wall"]
+            totals["cpu"] += record["cpu"]
+            totals["failed"] += record.get("failed", False)
+            totals["peak_rss"] = max(totals["peak_rss"], record["peak_rss"] or 0)
+            totals["peak_rss_delta"] = max(totals["peak_rss_delta"], record.get("peak_rss_delta") or 0)
+
+    lines = []
+    for metric, key, kind, description in [
+        ("reportgen_span_wall_seconds_total", "wall", "counter", "Wall time spent in each stage"),
+        ("reportgen_span_cpu_seconds_total", "cpu", "counter", "CPU time spent in each stage"),
+        ("reportgen_span_count_total", "count", "counter", "Number of times each stage ran"),
+        ("reportgen_span_failed_total", "failed", "counter", "Number of times each stage failed"),
+        ("reportgen_span_peak_rss_bytes", "peak_rss", "gauge", "Highest peak RSS of a process running each stage"),
+        ("reportgen_span_peak_rss_delta_bytes", "peak_rss_delta", "gauge",
+         "Most a run of each stage raised the peak RSS of its process"),
+    ]:
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, totals in sorted(prometheus_totals.items()):
+            lines.append(f'{metric}{{span="{name}"}} {totals[key]}')
+
+    # Replaced in one go so a scrape never reads a partly written file
+    with open(prometheus_file + ".tmp", 'w') as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(prometheus_file + ".tmp", prometheus_file)
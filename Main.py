@@ -1,14 +1,25 @@
 import os
 import re
 import glob
-import PyPDF2
 import shutil
-import math
+import time
+import threading
 
-from PIL import Image
-from Report import ReportGenerator
+from contextlib import ExitStack
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-# Requirements PyPDF2, Pillow, ReportLab
+from Report import ReportGenerator, apply_profile, write_output
+from Extract import process_pdf, cache_path
+from Images import resize_image, image_memory, OverviewTiles, PreparedImage
+from Preview import PagePreview
+from Template import default_template, load_template, render_plan
+from Instrument import configure, span, update_prometheus
+from History import record_session
+from Manifest import file_hash, load_manifest, save_manifest, reusable_image, reusable_tiles, report_key, \
+    tiles_manifest
+
+# Requirements PyPDF2, Pillow, ReportLab, NumPy
 
 
 # Function to check if there are at least two JPG files and at least one PDF file in a folder
@@ -22,131 +33,12 @@ def check_files(folder_path):
         raise ValueError("Folder does not contain at least two JPG files and one PDF file.")
 
 
-def resize_image(input_image_path, output_image_path, size):
-    with Image.open(input_image_path) as image:
-        resized_image = image.resize(size)
-        resized_image = resized_image.crop((155, 0, 2564, 3508))
-        resized_image.save(output_image_path)
-
-
-def split_image(input_image_path, output_image_folder):
-    # Open an image file
-    with Image.open(input_image_path) as img:
-        # Get the dimensions of the image
-        width, height = img.size
-        # Calculate the width and height of each section
-        section_width = width // 4
-        section_height = height // 2
-        # Iterate over the sections
-        for i in range(4):  # Number of sections horizontally
-            for j in range(2):  # Number of sections vertically
-                # Calculate the coordinates for cropping each section
-                left = i * section_width
-                upper = j * section_height
-                right = (i + 1) * section_width
-                lower = (j + 1) * section_height
-                # Crop the section
-                section = img.crop((left, upper, right, lower))
-                # Save the section as a new image
-                section.save(output_image_folder + "overview_" + str(i) + "_" + str(j) + ".jpg")
-
-
-def remove_leading_spaces(text):
-    pattern = r"^\s+"
-    return re.sub(pattern, "", text, flags=re.MULTILINE)
-
-
 def escape_file_path(file_path):
     # Replace backslashes with double backslashes
     escaped_path = re.sub(r'\\', r'\\\\', file_path)
     return escaped_path
 
 
-# Function to process the PDF file
-def process_pdf(pdf_path):
-    print(f"Processing PDF: {pdf_path}")
-
-    # Values to collect from PDF
-    search_terms = ["Spots", "Wrinkles", "Texture", "Pores", "UV Spots", "Brown Spots", "Red Areas", "Porphyrins"]
-    # Extract text from PDF
-    extracted_text = extract_text_from_pdf(pdf_path)
-    # Remove Leading spaces
-    cleaned_text = remove_leading_spaces(extracted_text)
-    # Find all occurrences of "Each Search Term (<content>)"
-    extracted_values = extract_values(cleaned_text, search_terms)
-
-    # Store all the data in a dictionary called data
-    if extracted_values is not None:
-        data = {term: value for term, value in zip(search_terms, extracted_values)}
-    else:
-        raise ValueError("No Values Found from PDF")
-
-    # Add the date to the dictionary
-    data["date"] = get_report_date(cleaned_text)
-    data["name"] = get_report_name(cleaned_text)
-
-    return data
-
-
-# Get the name on the report
-def get_report_name(text):
-    pattern = r"face\.(.+?)\s+\."
-    matches = re.findall(pattern, text, re.MULTILINE)
-    if len(matches) > 1:
-        raise ValueError(f"Multiple names found. Ambiguous result.")
-    elif matches:
-        name = matches[0]
-        return name
-    else:
-        raise ValueError(f"No name found.")
-
-
-# Get's the date from the report
-def get_report_date(text):
-    pattern = r"session:\s+([\d/]+)\s+"
-    matches = re.findall(pattern, text, re.MULTILINE)
-    if len(matches) > 1:
-        raise ValueError(f"Multiple dates found. Ambiguous result.")
-    elif matches:
-        date = matches[0]
-        return date
-    else:
-        raise ValueError(f"No date found.")
-
-
-# Extracts the values following specified search terms within parentheses.
-def extract_values(text, search_terms):
-    extracted_values = []
-
-    for search_term in search_terms:
-        matches = re.findall(rf"^{search_term}\s*\((\d+\.*\d*)\)", text, re.MULTILINE)
-        if len(matches) > 1:
-            raise ValueError(f"Multiple '{search_term}' data found. Ambiguous result.")
-        elif matches:
-            extracted_values.append(matches[0])
-        else:
-            raise ValueError(f"None of '{search_term}' data found.")
-
-    return extracted_values
-
-
-def extract_text_from_pdf(pdf_path):
-    # Open the PDF file in read-binary mode
-    with open(pdf_path, 'rb') as file:
-        # Create a PDF file reader object
-        pdf_reader = PyPDF2.PdfReader(file)
-
-        # Initialize an empty string to store the extracted text
-        text = ""
-
-        # Iterate through each page of the PDF
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text()
-
-    return text
-
-
 def check_and_create_folder(folder_path):
     # Check if the folder exists
     if not os.path.exists(folder_path):
@@ -164,509 +56,429 @@ def format_filename(folder_path):
 
     return folder_name
 
-def euclidean_distance(color1, color2):
-    # Calculate the Euclidean distance between two RGB colors.
-    r1, g1, b1 = color1
-    r2, g2, b2 = color2
-    return math.sqrt((r1 - r2) ** 2 + (g1 - g2) ** 2 + (b1 - b2) ** 2)
-
-
-# --- CONFIG --- #
-
-# Folder containing report files
-report_folder_path = r'C:\Users\Owner\Downloads\New folder (21)'
-# Report Folder Structure
-report_export_folder = r'C:\Users\Owner\Downloads\New folder (22)'
-# Image Size
-size = (2719, 3508)
-
-# --- PROGRAM --- #
-
-try:
 
-    # --- PREPARE --- #
+# Process a single session folder (PDF report & photos) into a report within the export folder, the report is also
+# written to the output stream if one is given
+def process_session(session_folder, export_root, size, output=None, image_executor=None):
+    # A session that has already been exported is brought up to date instead
+    if os.path.exists(os.path.join(session_folder, "files", "raw_report.pdf")):
+        return rebuild_session(session_folder, export_root, size, output, image_executor)
 
-    # Escape the folder path
-    escaped_files = escape_file_path(report_folder_path)
-    # Escape the export folder location
-    escaped_export = escape_file_path(report_export_folder)
+    print(f"Processing session: {session_folder}")
 
     # Check if there are at least two JPG files and at least one PDF file
-    check_files(escaped_files)
+    check_files(session_folder)
 
     # Collect all information from PDF Report
-    pdf_files = glob.glob(os.path.join(escaped_files, '*.pdf'))
-    for pdf_file in pdf_files:
-        data = process_pdf(pdf_file)
-
-    # Create folder for Customer if not existing
-    check_and_create_folder(fr"{escaped_export}\\" + format_filename(data["name"]))
-    # Create folder for this customers scan today as the date
-    check_and_create_folder(
-        fr"{escaped_export}\\" + format_filename(data["name"]) + "\\" + format_filename(data["date"]))
-
-    # Create variables for the export folder and pdf
-    export_folder = fr"{escaped_export}\\" + format_filename(data["name"]) + "\\" + format_filename(
-        data["date"]) + "\\files\\"
-    export_pdf = fr"{escaped_export}\\" + format_filename(data["name"]) + "\\" + format_filename(
-        data["date"]) + "\\" + format_filename(data["name"]) + "_Report.pdf"
+    pdf_files = glob.glob(os.path.join(session_folder, '*.pdf'))
+    if len(pdf_files) > 1:
+        raise ValueError(f"Multiple PDF files found in '{session_folder}'. Ambiguous session.")
+    data = process_pdf(pdf_files[0])
+
+    # Dont process any image labelled overview, this is the overview with 8 images
+    substring = "overview"
+    jpg_files = sorted(glob.glob(os.path.join(session_folder, '*.jpg')))
+    photos = list(enumerate([jpg_file for jpg_file in jpg_files if substring not in jpg_file], 1))
+    overview_files = [jpg_file for jpg_file in jpg_files if substring in jpg_file]
+    if not overview_files:
+        raise ValueError(f"No overview image found in '{session_folder}'.")
+    if len(overview_files) > 1:
+        raise ValueError(f"Multiple overview images found in '{session_folder}'. Ambiguous session.")
+
+    # Create the folder for this customers scan as the date
+    session_export = os.path.join(export_root, format_filename(data.name), format_filename(data.date))
+    export_folder = os.path.join(session_export, "files", "")
+    export_pdf = os.path.join(session_export, format_filename(data.name) + "_Report.pdf")
 
     # Create the export folder
     check_and_create_folder(export_folder)
 
     # --- RESIZE IMAGES & MOVE FILES --- #
 
-    i = 1
-    substring = "overview"
-    jpg_files = glob.glob(os.path.join(escaped_files, '*.jpg'))
-    for jpg_file in jpg_files:
-
-        # Dont process any image labelled overview
-        if substring not in jpg_file:
-
-            # Create a resized version of the image
-            resize_image(jpg_file, export_folder + "Image_" + str(i) + ".jpg", size)
-            # Progress Indicator
-            print(fr"Resized image {jpg_file}")
-            # Move the original file
-            # --- UNDONE MOVE FOR DEV --- #
-            shutil.move(jpg_file, export_folder + "Raw_Image_" + str(i) + ".jpg")
-            print(fr"Moved image {jpg_file}")
-
-            i = i + 1
-
-        # This is the overview with 8 images
+    # An earlier scan of the same patient & date may have had more photos, they're not part of this session
+    remove_photos_after(export_folder, len(photos))
+
+    # What was done the last time this session was processed, any stage whose inputs are unchanged is skipped
+    manifest = load_manifest(export_folder)
+
+    with ExitStack() as stack:
+        if image_executor is None:
+            image_executor = create_image_executor(stack, photos)
+        # Raw files are archived by threads while the images are prepared & the report rendered
+        file_executor = stack.enter_context(ThreadPoolExecutor(max_workers=len(jpg_files) + 1))
+
+        # Create a resized version of each image, the original is moved once it has been resized
+        prepared = prepare_photos(photos, export_folder, size, manifest, image_executor)
+        archived = []
+        for (i, jpg_file), (_, _, future) in zip(photos, prepared):
+            archived.append(file_executor.submit(move_after, future, jpg_file,
+                                                 export_folder + "Raw_Image_" + str(i) + ".jpg"))
+
+        # Sections of this image are cropped out as the report places them
+        overview_hash = file_hash(overview_files[0])
+        archived.append(file_executor.submit(move_file, overview_files[0], export_folder + "Raw_Image_Overview.jpg"))
+        tiles = OverviewTiles(export_folder + "Raw_Image_Overview.jpg", export_folder)
+        tiles.paths.update(reusable_tiles(manifest, export_folder, overview_hash))
+
+        # Move the pdf file and its cached values to the new destination
+        archived.append(file_executor.submit(move_file, pdf_files[0], export_folder + "raw_report.pdf"))
+        if os.path.exists(cache_path(pdf_files[0])):
+            archived.append(file_executor.submit(move_file, cache_path(pdf_files[0]),
+                                                 cache_path(export_folder + "raw_report.pdf")))
+
+        complete_session(data, prepared, tiles, overview_hash, export_folder, export_pdf, export_root, size,
+                         manifest, output, archived)
+
+    return export_pdf
+
+
+# Bring the report of an already exported session up to date from its archived files, only redoing the stages
+# whose inputs have changed since its manifest was saved, e.g. only rendering again after the template changed
+def rebuild_session(session_export, export_root, size, output=None, image_executor=None):
+    print(f"Rebuilding session: {session_export}")
+
+    export_folder = os.path.join(session_export, "files", "")
+    data = process_pdf(export_folder + "raw_report.pdf")
+    export_pdf = os.path.join(session_export, format_filename(data.name) + "_Report.pdf")
+
+    photos = []
+    for jpg_file in glob.glob(export_folder + "Raw_Image_*.jpg"):
+        match = re.search(r"Raw_Image_(\d+)\.jpg$", jpg_file)
+        if match is not None:
+            photos.append((int(match.group(1)), jpg_file))
+    photos.sort()
+    overview_file = export_folder + "Raw_Image_Overview.jpg"
+    if not os.path.exists(overview_file):
+        raise ValueError(f"No overview image found in '{export_folder}'.")
+
+    manifest = load_manifest(export_folder)
+
+    with ExitStack() as stack:
+        if image_executor is None:
+            image_executor = create_image_executor(stack, photos)
+
+        prepared = prepare_photos(photos, export_folder, size, manifest, image_executor)
+        overview_hash = file_hash(overview_file)
+        tiles = OverviewTiles(overview_file, export_folder)
+        tiles.paths.update(reusable_tiles(manifest, export_folder, overview_hash))
+
+        complete_session(data, prepared, tiles, overview_hash, export_folder, export_pdf, export_root, size,
+                         manifest, output)
+
+    return export_pdf
+
+
+# Remove the raw & resized photos numbered after count from the export folder
+def remove_photos_after(export_folder, count):
+    for jpg_file in glob.glob(export_folder + "*Image_*.jpg"):
+        match = re.fullmatch(r"(?:Raw_)?Image_(\d+)\.jpg", os.path.basename(jpg_file))
+        if match is not None and int(match.group(1)) > count:
+            os.remove(jpg_file)
+            print(fr"Removed {jpg_file} of an earlier scan")
+
+
+# Images are decoded in their own processes unless the caller gives an executor, e.g. a batch worker that is already
+# one of a pool of processes, or there is only the one CPU to decode on
+def create_image_executor(stack, photos):
+    workers = min(len(photos), os.cpu_count())
+    # Each process holds a decoded photo & its resized copy, no more are resized at once than fit in the memory budget
+    if memory_budget is not None and workers > 1:
+        largest = max(image_memory(photo_file) for _, photo_file in photos)
+        workers = min(workers, max(1, memory_budget // (2 * largest)))
+    if workers > 1:
+        return stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+    return stack.enter_context(ThreadPoolExecutor(max_workers=1))
+
+
+# Resize each (number, photo), unless the manifest shows it was already resized from the same photo at the same size
+# Returns the name, content hash & future prepared image of each photo
+def prepare_photos(photos, export_folder, size, manifest, image_executor):
+    prepared = []
+    for i, photo_file in photos:
+        name = "Image_" + str(i) + ".jpg"
+        photo_hash = file_hash(photo_file)
+        is_uv = reusable_image(manifest, export_folder, name, photo_hash, size)
+        if is_uv is None:
+            future = image_executor.submit(resize_image, photo_file, export_folder + name, size)
         else:
+            print(fr"Unchanged image {photo_file}")
+            future = Future()
+            future.set_result(PreparedImage(export_folder + name, is_uv))
+        prepared.append((name, photo_hash, future))
+    return prepared
+
+
+# Render the report unless nothing it's made from has changed since it was saved, then save the session's manifest
+def complete_session(data, prepared, tiles, overview_hash, export_folder, export_pdf, export_root, size, manifest,
+                     output, archived=()):
+    asset_folder = os.path.join(export_root, "Assets", "")
+    # Compiling the template prepares the asset images, as the report will embed them
+    apply_profile(output_profile)
+    template_version = load_template(default_template, asset_folder).version
+    key = report_key(template_version, data, [photo_hash for _, photo_hash, _ in prepared], overview_hash, size,
+                     [image_dpi, image_quality, report_size_budget, output_profile, page_preview_dpi])
+    report = manifest.get("report", {})
+
+    # Photo pages are drawn in order as each image becomes ready, the report pages after them once the raw files
+    # are archived as they crop the overview from its archived copy
+    def ready_images():
+        for _, _, future in prepared:
+            image = future.result()
+            # Progress Indicator
+            print(fr"Prepared image {image.path}")
+            yield image
+        for future in archived:
+            future.result()
+
+    if report.get("key") == key and os.path.exists(export_pdf):
+        print(fr"Report unchanged {export_pdf}")
+        list(ready_images())
+        if output is not None:
+            with open(export_pdf, 'rb') as file:
+                shutil.copyfileobj(file, output)
+    else:
+        pdf_data = render_report(data, ready_images(), tiles, export_pdf, asset_folder)
+        report = {"file": os.path.basename(export_pdf), "key": key}
+        if output is not None:
+            output.write(pdf_data)
+
+    # Kept even when the report is unchanged, so a history started after the session was exported still has it
+    record_session(export_root, data, os.path.dirname(export_pdf))
+
+    save_manifest(export_folder, {
+        "size": list(size),
+        "images": {name: {"sha256": photo_hash, "is_uv": future.result().is_uv}
+                   for name, photo_hash, future in prepared},
+        "overview": tiles_manifest(tiles, overview_hash),
+        "report": report,
+    })
+
+
+def move_file(source, destination):
+    shutil.move(source, destination)
+    print(fr"Moved {source}")
+
+
+# Move the file once the future using it is done, it stays in place if that failed
+def move_after(future, source, destination):
+    future.result()
+    move_file(source, destination)
+
+
+# Render the report pages for a session from its data & prepared images, returns the PDF data
+# The report is saved to export_pdf, which may be a path, a writable stream or None to keep it in memory only
+def render_report(data, images, tiles, export_pdf, asset_folder, template_file=default_template):
+    # The layout is compiled from the template the first time it's used in this process, then replayed for each report
+    plan = load_template(template_file, asset_folder)
+
+    # Images that are still being prepared are kept in case the report has to be rendered again
+    rendered_images = []
+
+    def ready_images():
+        for image in images:
+            rendered_images.append(image)
+            yield image
+
+    # Render with the photos at a lower resolution & quality each time until the report fits the size budget
+    dpi, quality = image_dpi, image_quality
+    for attempt in range(size_budget_attempts):
+        report = ReportGenerator(None, asset_folder, dpi, quality, output_profile)
+        render_plan(report, plan, data, rendered_images if attempt else ready_images(), tiles)
+        pdf_data = report.save_report()
+        if report_size_budget is None or len(pdf_data) <= report_size_budget or dpi is None:
+            break
+        print(f"Report is {len(pdf_data)} bytes, over the budget of {report_size_budget} bytes")
+        dpi, quality = round(dpi * 0.8), max(quality - 10, 40)
 
-            # Split this image into 8 sections
-            split_image(jpg_file, export_folder)
-            shutil.move(jpg_file, export_folder + "Raw_Image_Overview.jpg")
-            print(fr"Moved image {jpg_file}")
-
-    for pdf_file in pdf_files:
-        # Move the pdf file to the new destination
-        # --- UNDONE MOVE FOR DEV --- #
-        shutil.move(pdf_file, export_folder + "raw_report.pdf")
-        print(fr"Moved pdf {pdf_file}")
-
-    # --- CREATE PHOTO PAGES --- #
-
-    # Create the page
-    report = ReportGenerator(export_pdf, escaped_export + "\\Assets\\")
-
-    # Set some colours
-    ###
-    black = (0, 0, 0)
-    dark_grey = (0.1, 0.1, 0.1)
-    white = (255, 255, 255)
-    skn_blue = (0, 0.539, 0.625)
-    skn_purple = (0.34375, 0.296875, 0.4375)
-    ###
-
-    # Create pages for the images and place in the image on them
-    i = 1
-    for jpg_file in jpg_files:
-
-        # Dont create pages for overview images
-        if substring not in jpg_file:
-
-            # Open the image file
-            with Image.open(export_folder + "Image_" + str(i) + ".jpg") as img:
-                # Pick a single pixel of colour from the centre middle (the chin rest)
-                colour_sample = img.getpixel((1240, 3507))
-
-                # Is the colour closer to white or black
-                distance1 = euclidean_distance(colour_sample, black)
-                distance2 = euclidean_distance(colour_sample, white)
-
-            # Closest Colour is Black, Therefore this is the UV Image
-            if distance1 < distance2:
-
-                report.add_img(0, 297, 210, 297, export_folder + "Image_" + str(i) + ".jpg")
-                report.add_rect(0, 8, 47, 8, report.colours["white"], 0.5, True, False)
-
-                # Add the UV Spots Data
-                report.add_text(8.5, 8, "Feature Count: " + data["UV Spots"], "SKN-Caption")
-
-            # Closest Colour is White, Therefore this is a regular image
-            else:
-
-                # Add the image, width and height are in points converted to mm
-                report.add_img(0, 297, 210, 297, export_folder + "Image_" + str(i) + ".jpg")
-                # report.drawImage(export_folder + "Image_" + str(i) + ".jpg", 0, 0 * mm, 210 * mm, 297 * mm)
-
-            # Move to the next page
-            report.add_page()
-
-            # Iterate to next image
-            i = i + 1
-
-    # --- FIRST REPORT PAGE --- #
-
-    # Add the header and footer to this page
-    report.add_header_footer()
-
-    # Title Section
-    report.add_text(20, 252, "UV Photo-Aging", "SKN-Title")
-    report.add_text(20, 243, "Visible Premature Aging - Primary", "SKN-Sub-Title")
-
-    page_summary_text = "UV damage is not entirely invisible. While our UV photo gives you a look under the surface, damage accumulates and slowly effects the upper layers of the skin becoming visible over time. This is known as photo-aging."
-    report.add_para(20, 234, 170, 10, page_summary_text, "SKN-Body")
-
-    report.add_text(20, 220, "Patient Name:", "SKN-Heading")
-    report.add_text(100, 220, data['name'], "SKN-Heading")
-
-    report.add_text(20, 214, "Analysis Date:", "SKN-Sub-Heading")
-    report.add_text(100, 214, data['date'], "SKN-Sub-Heading")
-
-    # Add Photos
-    report.add_img(20, 201, 63.677, 82, export_folder + "overview_0_0.jpg")
-    report.add_img(20, 109, 63.677, 82, export_folder + "overview_1_0.jpg")
-
-    # Spot Analysis
-    spot_analysis_text = "These are also known as brown spots, liver spots, or hyperpigmentation."
-    spot_analysis_text_1 = "Often people think that freckles for example have been on their skin all their lives. However, if you examine baby photos you will find they haven't. These are caused by cumulative UV damage or particularly bad exposure in once instance. Inflammation from various sources often makes these worse as well."
-
-    report.add_text(90, 195, "Spot Analysis", "SKN-Coloured-Heading")
-
-    report.add_text(90, 184, "Age Spots Identified:", "SKN-Heading")
-    report.add_text(170, 184, data['Spots'], "SKN-Heading")
-    report.add_para(90, 173, 90, 30, spot_analysis_text, "SKN-Body")
-    report.add_text(90, 161, "Important Information", "SKN-Sub-Heading")
-    report.add_para(90, 154, 90, 30, spot_analysis_text_1, "SKN-Body")
-
-    # Wrinkle Analysis
-    wrinkle_analysis_text = "Wrinkles are the result of the breakdown of collagen and elastin proteins in your skin."
-    wrinkle_analysis_text_1 = "Collagen and elastin are what make your skin firm, supple, and resilient. UV Radiation directly damages and destroys collagen and elastin leading to wrinkles developing over years of exposure.  Virtually all wrinkles will be found in skin that is regularly exposed to sunlight as this is the primary cause of their development. "
-
-    report.add_text(90, 101, "Wrinkle Analysis", "SKN-Coloured-Heading")
-
-    report.add_text(90, 91, "Wrinkles Identified:", "SKN-Heading")
-    report.add_text(170, 91, data['Wrinkles'], "SKN-Heading")
-    report.add_para(90, 80, 90, 30, wrinkle_analysis_text, "SKN-Body")
-    report.add_text(90, 68, "Important Information:", "SKN-Sub-Heading")
-    report.add_para(90, 61, 90, 30, wrinkle_analysis_text_1, "SKN-Body")
-
-    # Move to the next page
-    report.add_page()
-    report.inc_page_num()
-
-    # --- SECOND REPORT PAGE --- #
-
-    # Add the header and footer to this page
-    report.add_header_footer()
+    # Save the report (Overrides)
+    write_output(export_pdf, pdf_data)
 
-    report.add_text(20, 252, "UV Photo-Aging", "SKN-Title")
-    report.add_text(20, 243, "Visible Premature Aging - Secondary", "SKN-Sub-Title")
+    # Previews of the pages are drawn from the same plan rather than from the PDF, beside a report saved to a file
+    if page_preview_dpi is not None and isinstance(export_pdf, str):
+        preview = PagePreview(asset_folder, page_preview_dpi)
+        with span("render_previews"):
+            render_plan(preview, plan, data, rendered_images, tiles)
+        preview.save_previews(os.path.splitext(export_pdf)[0])
+    return pdf_data
 
-    page_summary_text = "UV damage is not entirely invisible. While our UV photo gives you a look under the surface, damage accumulates and slowly effects the upper layers of the skin becoming visible over time. This is known as photo-aging."
-    report.add_para(20, 234, 170, 10, page_summary_text, "SKN-Body")
 
-    report.add_text(20, 220, "Patient Name:", "SKN-Heading")
-    report.add_text(100, 220, data['name'], "SKN-Heading")
+# Initializer of the worker processes, registers the report fonts, loads the asset images for the output profile &
+# compiles the template once in each worker rather than for every report
+def preload_worker(asset_folder, profile, template_file=default_template):
+    ReportGenerator.preload(asset_folder, profile)
+    load_template(template_file, asset_folder)
 
-    report.add_text(20, 214, "Analysis Date:", "SKN-Sub-Heading")
-    report.add_text(100, 214, data['date'], "SKN-Sub-Heading")
 
-    # Add Photos
-    report.add_img(20, 201, 63.677, 82, export_folder + "overview_2_0.jpg")
-    report.add_img(20, 109, 63.677, 82, export_folder + "overview_3_0.jpg")
+# Wrapper run in the worker processes, returns the report created and the time taken
+def run_session(session_folder, export_root, size):
+    start = time.perf_counter()
+    # The batch already has a worker process per CPU, the images are decoded on a thread alongside rendering
+    with span("session", process_cpu=True, session=session_folder), ThreadPoolExecutor(max_workers=1) as image_executor:
+        export_pdf = process_session(session_folder, export_root, size, image_executor=image_executor)
+    return export_pdf, time.perf_counter() - start
 
-    # Texture Analysis
-    texture_analysis_text = "Texture abnormalities are indications of undesirable patchy skin with a rougher texture."
-    texture_analysis_text_1 = "Texture abnormalities usually have the same causes as wrinkles, and can be the precursor for their development. It often also has causes related to moisture, oil loss and inflammation, all common effects of UV exposure. In short skin texture tends to improve as the overall health of your skin improves and any form of damage tends to show in the texture. "
 
-    report.add_text(90, 196, "Texture Analysis", "SKN-Coloured-Heading")
+# Find each session folder within the batch folder
+def find_sessions(batch_folder):
+    return sorted(entry.path for entry in os.scandir(batch_folder) if entry.is_dir())
 
-    report.add_text(90, 185, "Texture Abnormalities:", "SKN-Heading")
-    report.add_text(170, 185, data['Texture'], "SKN-Heading")
 
-    report.add_para(90, 174, 90, 30, texture_analysis_text, "SKN-Body")
-    report.add_text(90, 162, "Important Information:", "SKN-Sub-Heading")
-    report.add_para(90, 155, 90, 30, texture_analysis_text_1, "SKN-Body")
+# Estimated peak memory of a session's images in bytes, read from the image headers only
+# A photo & its resized copy are held while the report decodes the photo before to embed it, largest photo 4 times over
+def session_memory(session_folder):
+    jpg_files = glob.glob(os.path.join(session_folder, '*.jpg'))
+    jpg_files += glob.glob(os.path.join(session_folder, "files", "Raw_Image_*.jpg"))
+    memory = 0
+    for jpg_file in jpg_files:
+        try:
+            memory = max(memory, image_memory(jpg_file))
+        except OSError:
+            # An image that can't be read fails the session once it is processed
+            pass
+    return 4 * memory
+
+
+# Admission control for the sessions processed at once, a session is admitted while the estimated memory of those
+# admitted stays within the budget. A session is always admitted when there are none admitted so it never waits forever
+class MemoryBudget:
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.admitted = 0
+        self.memory = 0
+        self.condition = threading.Condition()
+
+    def fits(self, memory):
+        return self.budget is None or self.admitted == 0 or self.memory + memory <= self.budget
+
+    # Returns whether the session was admitted
+    def try_acquire(self, memory):
+        with self.condition:
+            if not self.fits(memory):
+                return False
+            self.admitted += 1
+            self.memory += memory
+            return True
+
+    # Wait until the session fits then admit it
+    def acquire(self, memory):
+        with self.condition:
+            self.condition.wait_for(lambda: self.fits(memory))
+            self.admitted += 1
+            self.memory += memory
+
+    def release(self, memory):
+        with self.condition:
+            self.admitted -= 1
+            self.memory -= memory
+            self.condition.notify_all()
+
+
+# Process every session within the batch folder across a pool of worker processes
+# Sessions are handed to the workers in order while their images fit in the memory budget (None for no limit)
+def process_batch(batch_folder, export_root, size, workers, memory_budget=None):
+    with span("find_sessions", batch=batch_folder) as labels:
+        session_folders = find_sessions(batch_folder)
+        labels["sessions"] = len(session_folders)
+    print(f"Found {len(session_folders)} sessions in '{batch_folder}'")
+
+    completed = []
+    failed = []
+    start = time.perf_counter()
+    budget = MemoryBudget(memory_budget)
+    pending = deque((session_folder, session_memory(session_folder)) for session_folder in session_folders)
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=preload_worker,
+                             initargs=(os.path.join(export_root, "Assets", ""), output_profile)) as executor:
+        while pending or running:
+            while pending and budget.try_acquire(pending[0][1]):
+                session_folder, memory = pending.popleft()
+                running[executor.submit(run_session, session_folder, export_root, size)] = (session_folder, memory)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                session_folder, memory = running.pop(future)
+                budget.release(memory)
+                # A failed session is recorded and does not stop the rest of the batch
+                try:
+                    export_pdf, seconds = future.result()
+                except Exception as e:
+                    failed.append((session_folder, e))
+                    print(f"Error: {session_folder}: {e}")
+                else:
+                    completed.append((session_folder, export_pdf, seconds))
+                    print(f"Created report {export_pdf} in {seconds:.2f}s")
+                update_prometheus()
+
+    print_batch_summary(completed, failed, time.perf_counter() - start, workers)
+
+    return completed, failed
+
+
+def print_batch_summary(completed, failed, elapsed, workers):
+    total = len(completed) + len(failed)
+    print("--- BATCH SUMMARY ---")
+    print(f"Sessions: {total}, Completed: {len(completed)}, Failed: {len(failed)}, Workers: {workers}")
+    print(f"Elapsed: {elapsed:.2f}s")
+    if completed:
+        average = sum(seconds for _, _, seconds in completed) / len(completed)
+        print(f"Throughput: {len(completed) / elapsed * 3600:.0f} reports/hour, "
+              f"Average session time: {average:.2f}s")
+    for session_folder, error in failed:
+        print(f"Failed: {session_folder}: {error}")
 
-    # Pore Analysis
-    pore_analysis_text = "Larger than normal pores individually identified in our analysis."
-    pore_analysis_text_1 = "Enlarged skin pores are caused by a couple of main causes. Sun damage is the first, UV radiation affecting the collagen often results in pores becoming larger and more open. The other common cause is increased oil production, which results in oily skin and enlarged pores. It should also be noted that increased oil production is another symptom of UV damage."
 
-    report.add_text(90, 103, "Pore Analysis", "SKN-Coloured-Heading")
+# --- CONFIG --- #
 
-    report.add_text(90, 93, "Enlarged Pores:", "SKN-Heading")
-    report.add_text(170, 93, data['Pores'], "SKN-Heading")
+# Folder containing report files
+report_folder_path = r'C:\Users\Owner\Downloads\New folder (21)'
+# Folder containing one folder per session to process as a batch (None processes report_folder_path only)
+batch_folder_path = None
+# Number of sessions to process at once in batch mode
+worker_count = os.cpu_count()
+# Report Folder Structure
+report_export_folder = r'C:\Users\Owner\Downloads\New folder (22)'
+# Image Size
+size = (2719, 3508)
+# Resolution photos are embedded at for the size they're placed at & their JPEG quality (None embeds them as is)
+image_dpi = 200
+image_quality = 85
+# How reports are encoded, one of Report.output_profiles: "standard", "fast", "compact" or "web" (the last two need
+# pikepdf or qpdf) or "reportlab"
+output_profile = "standard"
+# Largest size of a report in bytes, photos are embedded smaller until it fits (None for no limit)
+report_size_budget = None
+size_budget_attempts = 4
+# Resolution of the PNG preview of each page saved beside the report e.g. 40 (None for no previews)
+page_preview_dpi = None
+# Memory the images of the sessions processed at once may take in bytes, e.g. 2 * 1024 ** 3, further sessions wait
+# until theirs fit (None for no limit)
+memory_budget = None
+# JSON lines file the time & memory of each stage is recorded to (None to not record them)
+metrics_file = None
+# Prometheus text format file the recorded stages are totalled in (None for no file, requires metrics_file)
+prometheus_file = None
 
-    report.add_para(90, 82, 90, 30, pore_analysis_text, "SKN-Body")
-    report.add_text(90, 70, "Important Information:", "SKN-Sub-Heading")
-    report.add_para(90, 63, 90, 30, pore_analysis_text_1, "SKN-Body")
+# --- PROGRAM --- #
 
-    # Move to the next page
-    report.add_page()
-    report.inc_page_num()
+if __name__ == '__main__':
 
-    # --- THIRD REPORT PAGE --- #
+    try:
 
-    # Add the header and footer to this page
-    report.add_header_footer()
+        configure(metrics_file, prometheus_file)
 
-    report.add_text(20, 252, "UV Radiation", "SKN-Title")
-    report.add_text(20, 243, "Preventing UV Exposure", "SKN-Sub-Title")
+        # Escape the export folder location
+        escaped_export = escape_file_path(report_export_folder)
 
-    info_para1 = "Photoaging is enemy number one for every skin cell on your body. UV damage is the primary cause of looking older year after year. The good news is that you don’t just have to sit there and take it. "
-    info_para2 = "Your body adapts and responds. With proper protection from radiation, restoration will occur even without assistance. However, it won’t be fast for damage accumulated over many years."
-    report.add_para(20, 230, 135, 20, info_para1, "SKN-Body")
-    report.add_para(20, 215, 135, 20, info_para2, "SKN-Body")
-    report.add_text(20, 200, "The most important thing is that you protect your skin from exposure.", "SKN-Body")
-
-    report.add_img(160, 233, 30, 30, escaped_export + "\\Assets\\LearnMoreUV.png")
-    report.add_text(161, 205, "Learn More About", "SKN-Body")
-    report.add_text(165, 201, "UV Radiation", "SKN-Body")
-
-    report.add_img(20, 190, 175.37, 87.871, escaped_export + "\\Assets\\UVA-Radiation-Vs-UVB-Radiation.jpg")
-
-    report.add_text(20, 95, "The Dangers of UV-A", "SKN-Coloured-Heading")
-
-    info_para3 = "Unless you are welding or taking a spacewalk, there are only two kinds of UV radiation to pay attention to, UV-A and UV-B."
-    info_para4 = "UV-B is what causes your skin to burn from overexposure, this kind of radiation is a shorter wavelength. UV-A is what causes your skin to age, this radiation has a longer wavelength and penetrates deeply into the skin."
-    info_para5 = "The problem comes when people don’t understand the difference. UV-B radiation, with it’s shorter wavelength, is fairly easy to stop. A hat, window or even just shade will often suffice. However UV-A radiation is where the real danger lies. "
-    report.add_para(20, 85, 83, 20, info_para3, "SKN-Body")
-    report.add_para(20, 72, 83, 20, info_para4, "SKN-Body")
-    report.add_para(20, 47, 83, 20, info_para5, "SKN-Body")
-
-    info_para6 = "UV-A radiation penetrates through many objects, windows, shade, even heavy cloud cover or rain do not stop it. Even with great sun care routines, people are exposed heavily every single day without ever realizing it. This is where the majority of sun damage comes from. "
-    info_para7 = "UV-A even reflects off sidewalks, tiles, snow, and water, to just name a few surfaces, often resulting in much higher levels of exposure just by where you are standing. Often you are exposed just standing in a house with a window in the room. Combine this with the fact that 95% of UV radiation from the sun is UV-A and you find that UV-A is by far the biggest UV threat your body faces."
-    report.add_para(106, 85, 83, 20, info_para6, "SKN-Body")
-    report.add_para(106, 60, 83, 20, info_para7, "SKN-Body")
-
-    # Move to the next page
-    report.add_page()
-    report.inc_page_num()
-
-    # --- FOURTH REPORT PAGE --- #
-
-    # Add the header and footer to this page
-    report.add_header_footer()
-
-    report.add_text(20, 252, "SPF Ratings & Values", "SKN-Title")
-    report.add_text(20, 243, "Preventing UV Exposure", "SKN-Sub-Title")
-
-    info_para1 = "Most people choose a sunscreen based on the SPF value on the front. Unfortunately SPF is a poor measure for choosing sunscreen and has two major problems. "
-    info_para2 = "The first problem is that SPF does not measure protection from UV-A radiation, which we have already ascertained is the larger threat to your skin on a daily basis. SPF only measures UV-B protection. It’s far more important you choose a sunscreen marked as broad spectrum with well-chosen ingredients, than to have the highest possible SPF. Because while the higher SPF value may offer marginally better UV-B protection than a lower one, it may offer significantly less UV-A protection. Often the UV-A protection suffers in the marketing efforts of the UV-B protection increase."
-    info_para3 = "The second problem is that SPF has no influence on reapplication frequency. People often purchase a higher SPF and wait longer before reapplying, however application frequency is not affected at all by the higher SPF. "
-    info_para4 = "A final note on SPF 50. SPF 50 is often seen as the pinnacle of SPF protection in Australia. Unfortunately while SPF 50 sounds like almost double the lower rating of SPF 30, the reality is completely different. Would it surprise you to know that SPF 50 is only 1.3% more effective at blocking UV-B than SPF 30? "
-    info_para5 = "You can scan the QR code above to learn more about SPF values and how they are calculated, however suffice to say as shown by the infographic below. SPF is a very deceptive measure of sun protection. "
-    report.add_para(60, 230, 125, 30, info_para1, "SKN-Body")
-    report.add_para(60, 217, 125, 30, info_para2, "SKN-Body")
-    report.add_para(60, 184, 125, 30, info_para3, "SKN-Body")
-    report.add_para(60, 168, 125, 30, info_para4, "SKN-Body")
-    report.add_para(60, 148, 125, 30, info_para5, "SKN-Body")
-
-    report.add_text(20, 230, "Learn More About", "SKN-Body")
-    report.add_text(24, 226, "SPF Ratings", "SKN-Body")
-    report.add_img(20, 220, 30, 30, escaped_export + "\\Assets\\LearnMoreSPF.png")
-
-    report.add_img(20, 120, 170, 89.746, escaped_export + "\\Assets\\UVB-Radiation-SPF.jpg")
-
-    # Move to the next page
-    report.add_page()
-    report.inc_page_num()
-
-    # --- FIFTH REPORT PAGE --- #
-    """
-    report.add_text(20, 252, "Recommendations", "SKN-Title")
-    report.add_text(20, 243, "Analysis Summary & Recommendations", "SKN-Sub-Title")
-
-    report.add_text(20, 230, "Patient Name:", "SKN-Heading")
-    report.add_text(90, 230, data['name'], "SKN-Heading")
-
-    report.add_text(20, 224, "Analysis Date:", "SKN-Sub-Heading")
-    report.add_text(90, 224, data['date'], "SKN-Sub-Heading")
-
-    report.add_text(20, 215, "Melanin Spots:", "SKN-Heading")
-    report.add_text(90, 215, data['UV Spots'], "SKN-Heading")
-
-    report.add_text(20, 208, "Age Spots:", "SKN-Sub-Heading")
-    report.add_text(90, 208, data['Spots'], "SKN-Sub-Heading")
-    report.add_text(20, 203, "Wrinkles:", "SKN-Sub-Heading")
-    report.add_text(90, 203, data['Wrinkles'], "SKN-Sub-Heading")
-    report.add_text(110, 208, "Texture Abnormalities:", "SKN-Sub-Heading")
-    report.add_text(175, 208, data['Texture'], "SKN-Sub-Heading")
-    report.add_text(110, 203, "Enlarged Pores", "SKN-Sub-Heading")
-    report.add_text(175, 203, data['Pores'], "SKN-Sub-Heading")
-
-    report.add_text(20, 185, "Ingredients:", "SKN-Coloured-Heading")
-    report.add_text(20, 177, "Ingredients We Recommend", "SKN-Heading")
-    report.add_text(20, 170, "Zinc Oxide (Micronised)", "SKN-Sub-Heading")
-    report.add_text(20, 165, "Cucumber Extract", "SKN-Sub-Heading")
-    report.add_text(20, 160, "Aloe Vera", "SKN-Sub-Heading")
-    report.add_text(20, 155, "Argan Oil", "SKN-Sub-Heading")
-    report.add_text(20, 150, "Jojoba Oil", "SKN-Sub-Heading")
-    report.add_text(20, 145, "Papaya", "SKN-Sub-Heading")
-    report.add_text(20, 140, "Geranium Oil", "SKN-Sub-Heading")
-    report.add_text(20, 135, "Tea Tree Extract", "SKN-Sub-Heading")
-    report.add_text(20, 130, "Rosehip Oil", "SKN-Sub-Heading")
-    report.add_text(20, 125, "Safflower Oil", "SKN-Sub-Heading")
-    report.add_text(20, 120, "Raspberry", "SKN-Sub-Heading")
-    report.add_text(20, 115, "Lavender", "SKN-Sub-Heading")
-
-    report.add_text(110, 177, "We Suggest Avoiding", "SKN-Heading")
-    report.add_text(110, 170, "Zinc Oxide (Nano)", "SKN-Sub-Heading")
-    report.add_text(110, 165, "Titanium Dioxide", "SKN-Sub-Heading")
-    report.add_text(110, 160, "Octinoxate (Octyl-Methoxycinnamate)", "SKN-Sub-Heading")
-    report.add_text(110, 155, "Oxybenzone (Benzophenone-3)", "SKN-Sub-Heading")
-    report.add_text(110, 150, "Avobenzone (AVO)", "SKN-Sub-Heading")
-    report.add_text(110, 145, "PABA (p-aminobenzoic acid)", "SKN-Sub-Heading")
-    report.add_text(110, 140, "Cinoxate", "SKN-Sub-Heading")
-    report.add_text(110, 135, "Padimate-O", "SKN-Sub-Heading")
-    report.add_text(110, 130, "Methyl sinapate", "SKN-Sub-Heading")
-    report.add_text(110, 125, "Dibenzoylmethane and Parsol 1789", "SKN-Sub-Heading")
-    report.add_text(110, 120, "2-phenylbenzimidazole", "SKN-Sub-Heading")
-    report.add_text(110, 115, "4-Methyl-benzylidene-camphor (4-MBC)", "SKN-Sub-Heading")
-
-    report.add_img(105, 103, 108.564, 81.351, escaped_export + "\\Assets\\NaturalSunscreenFaceMoisturising_Finalist.jpg")
-    report.add_img(17, 62, 30, 30, escaped_export + "\\Assets\\FACE.png")
-
-    report.add_text(20, 95, "Sunscreen Recommended:", "SKN-Coloured-Heading")
-    report.add_text(20, 87, "Soléo Organics Face Moisturising", "SKN-Heading")
-
-    info_para1 = "Based on your scan we recommend this sunscreen for your daily use. This recommendation takes identified UV damage into consideration, and any physical signs of aging identified on the skin."
-    report.add_para(20, 80, 100, 30, info_para1, "SKN-Body")
-
-    report.add_text(50, 60, "Features:", "SKN-Heading")
-    report.add_text(50, 55, "SPF 30 Protection", "SKN-Sub-Heading")
-    report.add_text(50, 50, "Broad Spectrum", "SKN-Sub-Heading")
-    report.add_text(50, 45, "Lightly Moisturising", "SKN-Sub-Heading")
-    report.add_text(50, 40, "Non-Comedogenic", "SKN-Sub-Heading")
-
-    report.add_text(90, 55, "Anti-Aging", "SKN-Sub-Heading")
-    report.add_text(90, 50, "Matte (Non-Shiny)", "SKN-Sub-Heading")
-    report.add_text(90, 45, "Rubs in Clear", "SKN-Sub-Heading")
-
-    # Add the header and footer to this page
-    report.add_header_footer()
-    """
-
-    report.add_header_footer()
-
-    report.add_text(20, 252, "Recommendations", "SKN-Title")
-    report.add_text(20, 243, "Analysis Summary & Recommendations", "SKN-Sub-Title")
-
-    report.add_text(20, 230, "Patient Name:", "SKN-Heading")
-    report.add_text(90, 230, data['name'], "SKN-Heading")
-
-    report.add_text(20, 224, "Analysis Date:", "SKN-Sub-Heading")
-    report.add_text(90, 224, data['date'], "SKN-Sub-Heading")
-
-    report.add_text(20, 215, "Melanin Spots:", "SKN-Heading")
-    report.add_text(90, 215, data['UV Spots'], "SKN-Heading")
-
-    report.add_text(20, 208, "Age Spots:", "SKN-Sub-Heading")
-    report.add_text(90, 208, data['Spots'], "SKN-Sub-Heading")
-    report.add_text(20, 203, "Wrinkles:", "SKN-Sub-Heading")
-    report.add_text(90, 203, data['Wrinkles'], "SKN-Sub-Heading")
-    report.add_text(110, 208, "Texture Abnormalities:", "SKN-Sub-Heading")
-    report.add_text(175, 208, data['Texture'], "SKN-Sub-Heading")
-    report.add_text(110, 203, "Enlarged Pores", "SKN-Sub-Heading")
-    report.add_text(175, 203, data['Pores'], "SKN-Sub-Heading")
-
-    report.add_text(20, 188, "Sunscreen Ingredient Suggestions", "SKN-Coloured-Heading")
-
-    report.add_text(20, 178, "UV Protection:", "SKN-Heading")
-    report.add_text(20, 170, "Zinc Oxide (Micronised):", "SKN-Sub-Heading")
-    info_para1 = "Broad spectrum UV protection from UV-A I & UVA II. Highly stable in UV light. Anti-oxidant with anti-inflammatory properties."
-    report.add_para(20, 165, 80, 30, info_para1, "SKN-Body")
-    report.add_text(20, 150, "Geranium Oil:", "SKN-Sub-Heading")
-    info_para1 = "Very high in antioxidants. Helps the ward off free radicals. Assist the body in preventing UV damage. Astringent properties can help constrict pores."
-    report.add_para(20, 145, 80, 30, info_para1, "SKN-Body")
-    report.add_text(20, 130, "Tea Tree Extract:", "SKN-Sub-Heading")
-    info_para1 = "Contains catechins and flavonoids which act as sunscreen. Good source of Vitamin E. High in Antioxidants."
-    report.add_para(20, 125, 80, 30, info_para1, "SKN-Body")
-
-    report.add_text(110, 178, "Skin Conditioning:", "SKN-Heading")
-    report.add_text(110, 170, "Raspberry:", "SKN-Sub-Heading")
-    info_para1 = "Highly soothing. HIgh levels of Vitamins A and E. Helps create a lipid barrier to protect the skin from losing moisture."
-    report.add_para(110, 165, 80, 30, info_para1, "SKN-Body")
-    report.add_text(110, 150, "Aloe Vera:", "SKN-Sub-Heading")
-    info_para1 = "Highly soothing and mositurising. Helps counteract UV damage. High in vitamins A, E, and C. Astringent properties can help constrict pores."
-    report.add_para(110, 145, 80, 30, info_para1, "SKN-Body")
-    report.add_text(110, 130, "Cucumber Extract:", "SKN-Sub-Heading")
-    info_para1 = "Highly soothing skin care ingredient. Provides instant moisturisation and strengthens the skins natural mositure barrier."
-    report.add_para(110, 125, 80, 30, info_para1, "SKN-Body")
-
-    report.add_text(20, 105, "Photo-Aging Reduction:", "SKN-Heading")
-
-    report.add_text(20, 97, "Jojoba Oil:", "SKN-Sub-Heading")
-    info_para1 = "High in anti-oxidants. Helps fight off free radicals. High in vitamin E, and promotes skin cell regeneration."
-    report.add_para(20, 92, 80, 30, info_para1, "SKN-Body")
-    report.add_text(20, 77, "Argan Oil:", "SKN-Sub-Heading")
-    info_para1 = "Gently exfoliator. Assists in the restoration of sun damaged skin. Helps reduce fine lines. High in anti-oxidants."
-    report.add_para(20, 72, 80, 30, info_para1, "SKN-Body")
-    report.add_text(20, 56, "Rosehip Oil:", "SKN-Sub-Heading")
-    info_para1 = "Often used as a non-toxic alternative to retinol. Helps restore elasticity and promotes cell regeneration."
-    report.add_para(20, 50, 80, 30, info_para1, "SKN-Body")
-    report.add_text(110, 97, "Papaya Extract:", "SKN-Sub-Heading")
-    info_para1 = "Promotes skin turnover and renewal. Natural exfoliator. Rejuvenates stressed skin. Great for age spots and poor skin texture."
-    report.add_para(110, 92, 80, 30, info_para1, "SKN-Body")
-    report.add_text(110, 77, "Safflower Oil:", "SKN-Sub-Heading")
-    info_para1 = "High in polyphenols which inhibit enzymes that break down skin proteins like collagen and elastin. High in antioxidants. "
-    report.add_para(110, 72, 80, 30, info_para1, "SKN-Body")
-    report.add_text(110, 56, "Green Tea Extract:", "SKN-Sub-Heading")
-    info_para1 = "Helps prevent the breakdown of collagen and elastin. Reduces irritation and elastin damage. High in antioxidants."
-    report.add_para(110, 50, 80, 30, info_para1, "SKN-Body")
-
-    # Move to the next page
-    report.add_page()
-    report.inc_page_num()
-
-    # --- SIXTH REPORT PAGE --- #
-
-    report.add_header_footer()
-
-    report.add_text(20, 252, "Recommended Sunscreen", "SKN-Title")
-    report.add_text(20, 243, "Analysis Summary & Recommendations", "SKN-Sub-Title")
-
-    report.add_text(20, 230, "Patient Name:", "SKN-Heading")
-    report.add_text(90, 230, data['name'], "SKN-Heading")
-
-    report.add_text(20, 224, "Analysis Date:", "SKN-Sub-Heading")
-    report.add_text(90, 224, data['date'], "SKN-Sub-Heading")
-
-    report.add_img(105, 172, 108.564, 81.351, escaped_export + "\\Assets\\NaturalSunscreenFaceMoisturising_Finalist.jpg")
-
-    # report.add_img(165, 55, 30, 30, escaped_export + "\\Assets\\FACE.png")
-    # report.add_text(171, 28, "Learn More", "SKN-Body")
-
-    report.add_text(20, 200, "Sunscreen Recommendation", "SKN-Coloured-Heading")
-    report.add_text(20, 190, "We would like to offer the following sunscreen recommendation for use daily.", "SKN-Body")
-
-    report.add_text(20, 175, "Soléo Organics Face Moisturising", "SKN-Heading")
-    info_para1 = "This all natural sunscreen, avoids many of the chemicals associated high higher levels of irritation which can be counter productive. "
-    report.add_para(20, 165, 100, 30, info_para1, "SKN-Body")
-    info_para1 = "Based on a miconised zinc formula it offers strong protection from both UV-A and UV-B radiation, even in the higher UV-A I band. "
-    report.add_para(20, 152, 100, 30, info_para1, "SKN-Body")
-    info_para1 = "In addition it contains a mixture of other natural extracts to counteract the progress of UV damage on your skin thus far. For example, Rosehip oil to promote cell renewal and turnover, jojoba oil and argan oil to both exfoliate slightly and reduce fine lines and wrinkles that have already formed and safflower oil to reduce the degredation of the skins collagen and elastin. "
-    report.add_para(20, 139, 100, 30, info_para1, "SKN-Body")
-    info_para1 = "Finally as an all natural formula it helps promote sustainability with a completely biodegradable and reef safe formula and completely recyclable packaging."
-    report.add_para(20, 110, 100, 30, info_para1, "SKN-Body")
-
-    report.add_text(20, 90, "Summary:", "SKN-Heading")
-
-    report.add_text(20, 80, "SPF 30 Protection", "SKN-Sub-Heading")
-    report.add_text(20, 75, "Broad Spectrum", "SKN-Sub-Heading")
-    report.add_text(20, 70, "Lightly Moisturising", "SKN-Sub-Heading")
-    report.add_text(20, 65, "Non-Comedogenic", "SKN-Sub-Heading")
-    report.add_text(20, 60, "Biodegradable/Reef Safe", "SKN-Sub-Heading")
-    report.add_text(20, 55, "Cruelty Free", "SKN-Sub-Heading")
-
-    report.add_text(85, 80, "Anti-Aging", "SKN-Sub-Heading")
-    report.add_text(85, 75, "Reduces Fine Lines", "SKN-Sub-Heading")
-    report.add_text(85, 70, "Promotes Skin Renewal", "SKN-Sub-Heading")
-
-    report.add_text(145, 80, "Matte (Non Shiny)", "SKN-Sub-Heading")
-    report.add_text(145, 75, "Non-Comedogenic", "SKN-Sub-Heading")
-    report.add_text(145, 70, "Rubs in Clear", "SKN-Sub-Heading")
-    report.add_text(145, 65, "Effective Under Makeup", "SKN-Sub-Heading")
+        if batch_folder_path is not None:
+            process_batch(escape_file_path(batch_folder_path), escaped_export, size, worker_count, memory_budget)
+        else:
+            process_session(escape_file_path(report_folder_path), escaped_export, size)
 
-    # Save the report (Overrides)
-    report.save_report()
+    except ValueError as e:
+        print(f"Error: {e}")
 
-except ValueError as e:
-    print(f"Error: {e}")
+    finally:
+        # Totalled once the session is done, a failed session's stages included
+        update_prometheus()
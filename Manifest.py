@@ -0,0 +1,94 @@
+import os
+import re
+import glob
+import json
+import hashlib
+
+from dataclasses import asdict
+
+
+# Version of the manifest format, increase when what it records or the stages change
+manifest_version = 1
+# Saved in each session's export files folder
+manifest_name = "manifest.json"
+
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# The manifest of the session's last run, empty if there isn't one or it was written by another version
+def load_manifest(export_folder):
+    try:
+        with open(export_folder + manifest_name, 'r') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != manifest_version:
+        return {}
+    return manifest
+
+
+def save_manifest(export_folder, manifest):
+    try:
+        with open(export_folder + manifest_name + ".tmp", 'w') as file:
+            json.dump({"version": manifest_version, **manifest}, file, indent=2)
+        os.replace(export_folder + manifest_name + ".tmp", export_folder + manifest_name)
+    except OSError as e:
+        print(f"Could not save the manifest of {export_folder}: {e}")
+
+
+# Whether the manifest still describes the session's archived files, from their modified times rather than hashing them
+# It was saved for the same size after the files last changed & lists a resized image for each photo that still exists
+def manifest_current(manifest, export_folder, size):
+    if not manifest or manifest.get("size") != list(size):
+        return False
+    saved = os.path.getmtime(export_folder + manifest_name)
+    raw_files = glob.glob(export_folder + "Raw_Image_*.jpg") + [export_folder + "raw_report.pdf"]
+    if any(os.path.getmtime(raw_file) > saved for raw_file in raw_files):
+        return False
+    photos = [raw_file for raw_file in raw_files if re.search(r"Raw_Image_\d+\.jpg$", raw_file)]
+    images = manifest.get("images", {})
+    return len(photos) == len(images) and all(os.path.exists(export_folder + name) for name in images)
+
+
+# Whether the resized image can be reused, i.e. it was made from the same photo at the same size & still exists
+# Returns whether it is the UV image, None if it has to be resized again
+def reusable_image(manifest, export_folder, name, photo_hash, size):
+    previous = manifest.get("images", {}).get(name)
+    if previous is None or previous["sha256"] != photo_hash or manifest.get("size") != list(size):
+        return None
+    if not os.path.exists(export_folder + name):
+        return None
+    return previous["is_uv"]
+
+
+# The overview sections already cropped from the same overview, by their (i, j) position
+def reusable_tiles(manifest, export_folder, overview_hash):
+    previous = manifest.get("overview", {})
+    if previous.get("sha256") != overview_hash:
+        return {}
+    tiles = {}
+    for position, name in previous.get("tiles", {}).items():
+        if os.path.exists(export_folder + name):
+            i, j = position.split("_")
+            tiles[(int(i), int(j))] = export_folder + name
+    return tiles
+
+
+# Hash of everything the report is rendered from & how it's encoded, the report is only rendered again when this changes
+def report_key(template_version, data, photo_hashes, overview_hash, size, output_settings):
+    values = {field: str(value) for field, value in asdict(data).items()}
+    inputs = [template_version, values, photo_hashes, overview_hash, list(size), list(output_settings)]
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def tiles_manifest(tiles, overview_hash):
+    return {
+        "sha256": overview_hash,
+        "tiles": {f"{i}_{j}": os.path.basename(path) for (i, j), path in sorted(tiles.paths.items())},
+    }
@@ -0,0 +1,148 @@
+import os
+import functools
+
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+
+from Report import ReportGenerator, font_files, register_font, layout_paragraph
+from Instrument import span
+
+# Requirements as Main.py
+
+
+# Faces at a pixel size, the standard PDF fonts of the sample styles are stood in for by Pillow's own font
+@functools.lru_cache(maxsize=64)
+def preview_font(name, size, asset_folder):
+    if name in font_files:
+        return ImageFont.truetype(asset_folder + font_files[name], size)
+    return ImageFont.load_default(size)
+
+
+# An image at the pixels it covers in the preview, JPEGs are decoded at a reduced scale (1/2 - 1/8) to start with
+# so even a full size photo takes milliseconds
+@functools.lru_cache(maxsize=64)
+def preview_image(file, modified, size):
+    with Image.open(file) as image:
+        image.draft("RGB", size)
+        return image.convert("RGBA").resize(size, Image.BILINEAR)
+
+
+# Static blocks drawn once per process at each resolution, every page then only composites the layer
+static_layers = {}
+
+
+def rgba(colour, alpha=1):
+    # Style colours may be ReportLab colours rather than (r, g, b)
+    if hasattr(colour, "rgb"):
+        colour = colour.rgb()
+    return tuple(round(c * 255) for c in colour) + (round(alpha * 255),)
+
+
+# Draws a report plan as low resolution page images in place of a ReportGenerator, without creating the PDF
+# Text, shapes & images are drawn with Pillow where the template places them, close to but not exactly as in the PDF
+class PagePreview:
+
+    page_num: int = 1
+
+    def __init__(self, asset_folder, dpi=40, transparent=False):
+        self.asset_folder = asset_folder
+        self.dpi = dpi
+        self.scale = dpi / 72
+        self.size = (round(A4[0] * self.scale), round(A4[1] * self.scale))
+        self.styles = ReportGenerator.get_styles()
+        self.transparent = transparent
+        self.pages = []
+        self.new_page()
+
+    def new_page(self):
+        if self.transparent:
+            self.page = Image.new("RGBA", self.size, (255, 255, 255, 0))
+            self.draw = ImageDraw.Draw(self.page)
+        else:
+            # Drawn as RGBA onto RGB so shapes with an opacity blend with what's beneath them
+            self.page = Image.new("RGB", self.size, (255, 255, 255))
+            self.draw = ImageDraw.Draw(self.page, "RGBA")
+
+    # Pixel position of a point from the bottom left of the page
+    def point(self, x, y):
+        return x * self.scale, self.size[1] - y * self.scale
+
+    def font(self, name, size):
+        return preview_font(name, max(1, round(size * self.scale)), self.asset_folder)
+
+    def add_static(self, name, draw):
+        key = (draw, self.dpi)
+        if key not in static_layers:
+            layer = PagePreview(self.asset_folder, self.dpi, transparent=True)
+            draw(layer)
+            static_layers[key] = layer.page
+        self.page.paste(static_layers[key], (0, 0), static_layers[key])
+
+    def add_para(self, x, y, width, height, text, style):
+        style_info = self.styles[style]
+        register_font(style_info.fontName, self.asset_folder)
+        para, h = layout_paragraph(text, style_info, width * mm, height * mm)
+        self.draw_para(x * mm, (y * mm) - h, para)
+
+    def draw_rect(self, x, y, width, height, colour, opacity, fill, stroke):
+        left, bottom = self.point(x, y)
+        right, top = self.point(x + width, y + height)
+        self.draw.rectangle((left, top, right, bottom), fill=rgba(colour, opacity) if fill else None,
+                            outline=(0, 0, 0, 255) if stroke else None)
+
+    def draw_line(self, x_start, x_end, y_start, y_end, width, colour):
+        self.draw.line([self.point(x_start, y_start), self.point(x_end, y_end)], fill=rgba(colour),
+                       width=max(1, round(width * self.scale)))
+
+    def draw_text(self, x, y, text, style):
+        self.draw.text(self.point(x, y), text, font=self.font(style.fontName, style.fontSize),
+                       fill=rgba(style.textColor), anchor="ls")
+
+    def draw_para(self, x, y, para):
+        # The lines as ReportLab broke them, each a leading below the last from the top of the paragraph
+        style = para.style
+        baseline = y + para.height - style.fontSize
+        for line in para.blPara.lines:
+            if para.blPara.kind == 0:
+                extra_space, fragments = line[0], [(" ".join(line[1]), style)]
+            else:
+                extra_space = line.extraSpace
+                fragments = [(fragment.text, fragment) for fragment in line.words if hasattr(fragment, "text")]
+            left = x + extra_space * {TA_CENTER: 0.5, TA_RIGHT: 1}.get(style.alignment, 0)
+            for text, fragment in fragments:
+                font = self.font(fragment.fontName, fragment.fontSize)
+                self.draw.text(self.point(left, baseline), text, font=font, fill=rgba(fragment.textColor),
+                               anchor="ls")
+                left += font.getlength(text) / self.scale
+            baseline -= style.leading
+
+    def draw_img(self, x, y, width, height, file: str):
+        left, top = self.point(x, y + height)
+        size = (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+        image = preview_image(file, os.path.getmtime(file), size)
+        self.page.paste(image, (round(left), round(top)), image)
+
+    def add_bookmark(self, key, title, level=0):
+        pass
+
+    def add_page(self):
+        self.pages.append(self.page)
+        self.new_page()
+
+    def inc_page_num(self):
+        self.page_num = self.page_num + 1
+
+    def set_page_num(self, num: int):
+        self.page_num = num
+
+    # Save each page as <prefix>_page_<number>.png, returns the files saved
+    def save_previews(self, prefix):
+        with span("save_previews") as labels:
+            files = []
+            for number, page in enumerate(self.pages + [self.page], 1):
+                files.append(f"{prefix}_page_{number}.png")
+                page.save(files[-1], compress_level=1)
+            labels["pages"] = len(files)
+        return files
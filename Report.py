@@ -1,6 +1,18 @@
+import io
+import os
+import copy
+import shutil
 import decimal
+import tempfile
+import functools
+import threading
+import subprocess
 
+from typing import NamedTuple, Optional
+
+from reportlab import rl_config
 from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfdoc
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.pdfbase import pdfmetrics
@@ -8,6 +20,192 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.platypus import Paragraph
+from reportlab.lib.utils import _digester
+from PIL import Image
+
+from Instrument import span
+
+# Packing objects into object streams & linearizing need pikepdf or else the qpdf command, both are optional
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+qpdf = shutil.which("qpdf")
+
+
+# Font file of each face, registered with ReportLab once per process the first time the face is used
+font_files = {
+    "OpenSans-Bold": "OpenSans-Bold.ttf",
+    "OpenSans-BoldItalic": "OpenSans-BoldItalic.ttf",
+    "OpenSans-ExtraBold": "OpenSans-ExtraBold.ttf",
+    "OpenSans-ExtraBoldItalic": "OpenSans-ExtraBoldItalic.ttf",
+    "OpenSans-Italic": "OpenSans-Italic.ttf",
+    "OpenSans-Light": "OpenSans-Light.ttf",
+    "OpenSans-LightItalic": "OpenSans-LightItalic.ttf",
+    "OpenSans-Medium": "OpenSans-Medium.ttf",
+    "OpenSans-MediumItalic": "OpenSans-MediumItalic.ttf",
+    "OpenSans-Regular": "OpenSans-Regular.ttf",
+    "OpenSans-SemiBold": "OpenSans-SemiBold.ttf",
+    "OpenSans-SemiBoldItalic": "OpenSans-SemiBoldItalic.ttf",
+}
+registered_fonts = set()
+
+
+def register_font(name, asset_folder):
+    # Standard PDF fonts such as those of the sample stylesheet need no registering
+    if name in registered_fonts or name not in font_files:
+        return
+    pdfmetrics.registerFont(TTFont(name, asset_folder + font_files[name]))
+    registered_fonts.add(name)
+
+
+# Images from the asset folder used in every report
+asset_images = [
+    "SkinElementsLogo.jpg",
+    "LearnMoreUV.png",
+    "LearnMoreSPF.png",
+    "UVA-Radiation-Vs-UVB-Radiation.jpg",
+    "UVB-Radiation-SPF.jpg",
+    "NaturalSunscreenFaceMoisturising_Finalist.jpg",
+]
+prepared_images = {}
+
+
+def prepare_image(file):
+    # Load & encode the image (and the soft mask of any PNG alpha channel) ready to embed, once per process
+    key = (file, rl_config.useA85)
+    if key not in prepared_images:
+        # Named the same way canvas.drawImage names an image given by file name, so drawImage reuses it
+        name = _digester(f"{file}auto")
+        image = pdfdoc.PDFImageXObject(name, file, mask="auto")
+        image.name = name
+        prepared_images[key] = image
+    return prepared_images[key]
+
+
+@functools.lru_cache(maxsize=16)
+def optimise_image(file, modified, pixels, quality, use_a85):
+    # Downsample & re-encode a photo to the pixels it is placed at, None if it's already no larger as a JPEG
+    with span("optimise_image", image=file) as labels, Image.open(file) as image:
+        pixels = (min(pixels[0], image.width), min(pixels[1], image.height))
+        if image.format == "JPEG" and pixels == image.size:
+            return None
+        image.draft("RGB", pixels)
+        buffer = io.BytesIO()
+        resized = image.convert("RGB").resize(pixels, Image.LANCZOS, reducing_gap=3.0)
+        resized.save(buffer, "JPEG", quality=quality, optimize=True)
+        labels["source_bytes"] = os.path.getsize(file)
+        labels["bytes"] = buffer.tell()
+
+    # Named the same way canvas.drawImage names an image given by file name without a mask, so drawImage uses it
+    name = _digester(f"{file}None")
+    optimised = pdfdoc.PDFImageXObject(name)
+    buffer.seek(0)
+    optimised.loadImageFromJPEG(buffer)
+    return optimised
+
+
+# How a report is encoded when it's saved
+class OutputProfile(NamedTuple):
+    # Flate compress the content of the pages & forms
+    page_compression: bool
+    # ASCII85 encode streams so the file is 7 bit text, it's then about a quarter larger & slower to write
+    ascii85: bool
+    # zlib level to compress the streams again at, None leaves them as ReportLab compressed them (level 6)
+    compression_level: Optional[int]
+    # Pack the objects other than streams into compressed object streams
+    object_streams: bool
+    # Linearize ("fast web view") so a viewer shows the first page before the whole file has been downloaded
+    linearize: bool
+
+
+# The profiles a report can be saved with, those that compress again, pack or linearize need pikepdf or qpdf
+output_profiles = {
+    # As ReportLab saves by default
+    "reportlab": OutputProfile(True, True, None, False, False),
+    # The smallest file ReportLab alone saves
+    "standard": OutputProfile(True, False, None, False, False),
+    # Quickest to save, the page content is left uncompressed
+    "fast": OutputProfile(False, False, None, False, False),
+    "compact": OutputProfile(True, False, 9, True, False),
+    # For reports opened from a web server or a slow share
+    "web": OutputProfile(True, False, 9, True, True),
+}
+# Profiles already warned about being saved without the tool they need
+warned_profiles = set()
+# pikepdf's compression level is set for the whole process, so only one report at a time is saved with a level
+pikepdf_lock = threading.Lock()
+
+
+# Whether the profile is saved as it asks, those finished after ReportLab need pikepdf or qpdf installed
+def profile_applied(name):
+    profile = output_profiles[name]
+    if profile.compression_level is None and not profile.object_streams and not profile.linearize:
+        return True
+    return pikepdf is not None or qpdf is not None
+
+
+# Use the profile's settings that ReportLab reads for the whole process, returns the profile
+# Prepared images are kept for the ASCII85 setting they were encoded with, so this is applied before any are prepared
+# ahead of the reports, or the first report encodes them again
+def apply_profile(name):
+    profile = output_profiles[name]
+    if not profile_applied(name) and name not in warned_profiles:
+        print(f"Warning: the '{name}' output profile needs pikepdf or qpdf, neither is installed so reports are saved "
+              f"as ReportLab writes them, no smaller than with the 'standard' profile")
+        warned_profiles.add(name)
+    rl_config.useA85 = int(profile.ascii85)
+    return profile
+
+
+# Compress again, pack & linearize the saved PDF as the profile asks, it is left as it is when neither tool is installed
+def finish_pdf(data, profile):
+    if profile.compression_level is None and not profile.object_streams and not profile.linearize:
+        return data
+
+    if pikepdf is not None:
+        output = io.BytesIO()
+        with pikepdf_lock, pikepdf.open(io.BytesIO(data)) as pdf:
+            if profile.compression_level is not None:
+                pikepdf.settings.set_flate_compression_level(profile.compression_level)
+            try:
+                pdf.save(output, linearize=profile.linearize, recompress_flate=profile.compression_level is not None,
+                         object_stream_mode=pikepdf.ObjectStreamMode.generate if profile.object_streams
+                         else pikepdf.ObjectStreamMode.preserve)
+            finally:
+                # Back to zlib's default level for anything else saved with pikepdf in this process
+                pikepdf.settings.set_flate_compression_level(-1)
+        return output.getvalue()
+
+    if qpdf is not None:
+        arguments = [qpdf, "--object-streams=" + ("generate" if profile.object_streams else "preserve")]
+        if profile.linearize:
+            arguments.append("--linearize")
+        if profile.compression_level is not None:
+            arguments += ["--recompress-flate", f"--compression-level={profile.compression_level}"]
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, "report.pdf")
+            target = os.path.join(folder, "finished.pdf")
+            with open(source, 'wb') as file:
+                file.write(data)
+            result = subprocess.run(arguments + [source, target], capture_output=True)
+            # qpdf exits with 3 when it succeeded with warnings
+            if result.returncode in (0, 3):
+                with open(target, 'rb') as file:
+                    return file.read()
+        print(f"qpdf could not finish the report: {result.stderr.decode(errors='replace').strip()}")
+        return data
+
+    # apply_profile has warned the profile can't be applied
+    return data
+
+
+@functools.lru_cache(maxsize=512)
+def layout_paragraph(text, style, width, height):
+    # Wrap the paragraph once, the same text in the same style & box is then reused by every report in the process
+    para = Paragraph(text, style)
+    _, h = para.wrap(width, height)
+    return para, h
 
 
 class ReportGenerator:
@@ -22,32 +220,53 @@ class ReportGenerator:
 
     page_num: int = 1
 
-    def __init__(self, output_file=str, asset_folder=str):
+    def __init__(self, output_file=None, asset_folder=str, image_dpi=None, image_quality=85, profile="standard"):
 
+        # A path to save the report to, a writable stream such as a buffer or None to only return the PDF data
         self.output_file = output_file
-        self.c = canvas.Canvas(self.output_file, pagesize=A4)
+        # How the report is encoded, one of output_profiles
+        # ReportLab reads whether to ASCII85 encode from its settings for the whole process, so reports rendered at
+        # the same time in one process must use profiles that agree on it
+        self.profile = apply_profile(profile)
+        self.c = canvas.Canvas(io.BytesIO() if output_file is None else output_file, pagesize=A4,
+                               pageCompression=int(self.profile.page_compression))
         self.page_width, self.page_height = A4
-        self.register_fonts(asset_folder)
         self.styles = self.get_styles()
         self.asset_folder = asset_folder
+        # Names of the static blocks recorded as form XObjects in this report
+        self.forms = set()
+        # Resolution & JPEG quality photos are embedded at for the size they are placed at, None embeds them as is
+        self.image_dpi = image_dpi
+        self.image_quality = image_quality
+        # Graphics state last set on the current page or form, only changes to it are written
+        self.state = {}
+        # Text object consecutive strings are drawn into, until something other than text is drawn
+        self.text = None
+
+    @classmethod
+    def preload_fonts(cls, asset_folder, names=None):
+        # Register fonts ahead of their first use, by default those used by the report styles
+        if names is None:
+            names = {getattr(style, "fontName", None) for style in cls.get_styles().byName.values()}
+        for name in names:
+            register_font(name, asset_folder)
+
+    @classmethod
+    def preload_assets(cls, asset_folder):
+        for name in asset_images:
+            prepare_image(asset_folder + name)
 
-    @staticmethod
-    def register_fonts(asset_folder):
-        # Register Fonts
-        pdfmetrics.registerFont(TTFont('OpenSans-Bold', asset_folder + "OpenSans-Bold.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-BoldItalic', asset_folder + "OpenSans-BoldItalic.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-ExtraBold', asset_folder + "OpenSans-ExtraBold.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-ExtraBoldItalic', asset_folder + "OpenSans-ExtraBoldItalic.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-Italic', asset_folder + "OpenSans-Italic.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-Light', asset_folder + "OpenSans-Light.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-LightItalic', asset_folder + "OpenSans-LightItalic.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-Medium', asset_folder + "OpenSans-Medium.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-MediumItalic', asset_folder + "OpenSans-MediumItalic.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-Regular', asset_folder + "OpenSans-Regular.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-SemiBold', asset_folder + "OpenSans-SemiBold.ttf"))
-        pdfmetrics.registerFont(TTFont('OpenSans-SemiBoldItalic', asset_folder + "OpenSans-SemiBoldItalic.ttf"))
-
-    def get_styles(self):
+    @classmethod
+    def preload(cls, asset_folder, profile="standard"):
+        # Prepare everything shared between reports for the output profile, for example in a worker process' initializer
+        apply_profile(profile)
+        cls.preload_fonts(asset_folder)
+        cls.preload_assets(asset_folder)
+
+    # The styles are shared by every report so laid out paragraphs can be reused between them
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def get_styles(cls):
         styles = getSampleStyleSheet()
         # Create a custom style based on an existing style
         body_style = ParagraphStyle(
@@ -55,7 +274,7 @@ class ReportGenerator:
             parent=styles['Normal'],
             fontName='OpenSans-Regular',
             wordWrap='default',
-            textColor=self.colours["darkgrey"],
+            textColor=cls.colours["darkgrey"],
             fontSize=9,
             charSpace=0,
         )
@@ -64,7 +283,7 @@ class ReportGenerator:
             parent=styles['Normal'],
             fontName='OpenSans-ExtraBold',
             wordWrap='none',
-            textColor=self.colours["blue"],
+            textColor=cls.colours["blue"],
             fontSize=32,
             charSpace=0,
         )
@@ -73,7 +292,7 @@ class ReportGenerator:
             parent=styles['Normal'],
             fontName='OpenSans-Bold',
             wordWrap='none',
-            textColor=self.colours["purple"],
+            textColor=cls.colours["purple"],
             fontSize=15,
             charSpace=0,
         )
@@ -82,7 +301,7 @@ class ReportGenerator:
             parent=styles['Normal'],
             fontName='OpenSans-Bold',
             wordWrap='none',
-            textColor=self.colours["black"],
+            textColor=cls.colours["black"],
             fontSize=12,
             charSpace=0,
         )
@@ -91,7 +310,7 @@ class ReportGenerator:
             parent=styles['Normal'],
             fontName='OpenSans-Regular',
             wordWrap='none',
-            textColor=self.colours["black"],
+            textColor=cls.colours["black"],
             fontSize=11,
             charSpace=0,
         )
@@ -100,7 +319,7 @@ class ReportGenerator:
             parent=styles['Normal'],
             fontName='OpenSans-ExtraBold',
             wordWrap='none',
-            textColor=self.colours["blue"],
+            textColor=cls.colours["blue"],
             fontSize=17,
             charSpace=0,
         )
@@ -109,7 +328,7 @@ class ReportGenerator:
             parent=styles['Normal'],
             fontName='OpenSans-Light',
             wordWrap='none',
-            textColor=self.colours["blue"],
+            textColor=cls.colours["blue"],
             fontSize=10.5,
             charSpace=1,
         )
@@ -118,7 +337,7 @@ class ReportGenerator:
             parent=styles['Normal'],
             fontName='OpenSans-Light',
             wordWrap='none',
-            textColor=self.colours["purple"],
+            textColor=cls.colours["purple"],
             fontSize=10.5,
             charSpace=1,
         )
@@ -127,7 +346,7 @@ class ReportGenerator:
             parent=styles['Normal'],
             fontName='OpenSans-Bold',
             wordWrap='none',
-            textColor=self.colours["white"],
+            textColor=cls.colours["white"],
             fontSize=9,
             charSpace=0,
         )
@@ -143,53 +362,152 @@ class ReportGenerator:
 
         return styles
 
-    def add_header_footer(self):
-        # Place Header & Footer Lines
-        self.add_line(20, 190, 270, 270, 0.5, self.colours["purple"])
-        self.add_line(20, 190, 20, 20, 0.5, self.colours["purple"])
-        # Place the company logo
-        self.add_img(20, 286, 46, 12.451, self.asset_folder + "SkinElementsLogo.jpg")
-        # Place the Footer Text
-        self.add_text(20, 18, str(self.page_num) + " |", "SKN-Footer-Blue")
-        self.add_text(26, 18, " SKIN ELEMENTS LIMITED |", "SKN-Footer-Purple")
-        self.add_text(79, 18, " FACE UV ANALYSIS ", "SKN-Footer-Blue")
+    def add_static(self, name, draw):
+        # Record a block that is the same in every report as a form the first time it's used, then place the form
+        self.end_text()
+        if name not in self.forms:
+            # A form can be placed on any page whatever its state, so it sets all it uses. The page's state is as it
+            # was once the form is placed
+            page_state = self.state
+            self.state = {}
+            self.c.beginForm(name)
+            draw(self)
+            self.end_text()
+            self.c.endForm()
+            self.forms.add(name)
+            self.state = page_state
+        self.c.doForm(name)
 
     def add_rect(self, x, y, width, height, colour: tuple, opacity: float, fill: bool, stroke: bool):
-        self.c.setFillColorRGB(*colour, alpha=opacity)
-        self.c.rect(x * mm, (y * mm) - (height * mm), width * mm, height * mm, fill=fill, stroke=stroke)
+        self.draw_rect(x * mm, (y * mm) - (height * mm), width * mm, height * mm, colour, opacity, fill, stroke)
 
     def add_line(self, x_start, x_end, y_start, y_end, width, colour):
-        self.c.setLineWidth(width)
-        self.c.setStrokeColorRGB(*colour, alpha=1)
-        # Add the Line
-        self.c.line(x_start * mm, y_start * mm, x_end * mm, y_end * mm)
+        self.draw_line(x_start * mm, x_end * mm, y_start * mm, y_end * mm, width, colour)
 
     def add_text(self, x, y, text, style):
         style_info = self.styles[style]
-        # Calculate the height of the string
-        h = style_info.leading
-        self.c.setFont(style_info.fontName, style_info.fontSize)
-        self.c.setFillColorRGB(*style_info.textColor, alpha=1)
+        register_font(style_info.fontName, self.asset_folder)
         # Place the specified text at the specified location (Place using top left corner not default of bottom left)
-        self.c.drawString(x * mm, (y * mm) - h, text, mode=0, charSpace=style_info.charSpace)
+        self.draw_text(x * mm, (y * mm) - style_info.leading, text, style_info)
 
     def add_para(self, x, y, width, height, text, style):
-        # Create a paragraph object containing the correct text in the right style
-        para = Paragraph(text, self.styles[f"{style}"])
-        # Correct any alpha changes
-        self.c.setFillColorRGB(*self.styles[f"{style}"].textColor, alpha=1)
-        # Calculate the Height
-        h = self.styles[f"{style}"].leading * len(para.breakLines(width * mm).lines)
-        # Wrap the paragraph in the bounding box defined here
-        para.wrapOn(self.c, width * mm, height * mm)
+        style_info = self.styles[style]
+        register_font(style_info.fontName, self.asset_folder)
+        # Get the paragraph laid out in the bounding box defined here & its height
+        para, h = layout_paragraph(text, style_info, width * mm, height * mm)
         # Place the specified text at the specified location (Place using top left corner not default of bottom left)
-        para.drawOn(self.c, x * mm, (y * mm) - h)
+        self.draw_para(x * mm, (y * mm) - h, para)
 
     def add_img(self, x, y, width, height, file: str):
-        self.c.drawImage(file, x * mm, (y * mm) - (height * mm), width * mm, height * mm)
+        self.draw_img(x * mm, (y * mm) - (height * mm), width * mm, height * mm, file)
+
+    # The draw_ methods take positions in points from the bottom left & styles already looked up, as a compiled
+    # template resolves them ahead of time
+
+    def draw_rect(self, x, y, width, height, colour, opacity, fill, stroke):
+        self.end_text()
+        self.set_fill_colour(colour, opacity)
+        self.c.rect(x, y, width, height, fill=fill, stroke=stroke)
+
+    def draw_line(self, x_start, x_end, y_start, y_end, width, colour):
+        self.end_text()
+        if self.state.get("line_width") != width:
+            self.c.setLineWidth(width)
+            self.state["line_width"] = width
+        if self.state.get("stroke_alpha") != 1:
+            self.c.setStrokeAlpha(1)
+            self.state["stroke_alpha"] = 1
+        if self.state.get("stroke") != colour:
+            self.c.setStrokeColorRGB(*colour)
+            self.state["stroke"] = colour
+        # Add the Line
+        self.c.line(x_start, y_start, x_end, y_end)
+
+    def draw_text(self, x, y, text, style):
+        self.set_fill_colour(style.textColor, 1)
+        if self.text is None:
+            self.text = self.c.beginText(x, y)
+            self.state.pop("font", None)
+        else:
+            self.text.setTextOrigin(x, y)
+        # The font is written with the first string drawn in it
+        if self.state.get("font") != (style.fontName, style.fontSize):
+            self.text.setFont(style.fontName, style.fontSize)
+            self.state["font"] = (style.fontName, style.fontSize)
+        if style.charSpace:
+            self.text.setCharSpace(style.charSpace)
+        self.text.textOut(text)
+        if style.charSpace:
+            self.text.setCharSpace(0)
+
+    def draw_para(self, x, y, para):
+        self.end_text()
+        # Correct any alpha changes, the paragraph sets its own colour & restores the state once drawn
+        self.set_fill_colour(self.state.get("fill"), 1)
+        para.drawOn(self.c, x, y)
+
+    def draw_img(self, x, y, width, height, file: str):
+        self.end_text()
+        if file.startswith(self.asset_folder):
+            self.add_prepared_image(prepare_image(file))
+            self.c.drawImage(file, x, y, width, height, mask="auto")
+        else:
+            if self.image_dpi is not None:
+                # Pixels needed at the DPI for the size the photo is placed at, width & height are in points
+                pixels = (round(width / 72 * self.image_dpi), round(height / 72 * self.image_dpi))
+                optimised = optimise_image(file, os.path.getmtime(file), pixels, self.image_quality, rl_config.useA85)
+                if optimised is not None:
+                    self.add_prepared_image(optimised)
+            self.c.drawImage(file, x, y, width, height)
+
+    def add_prepared_image(self, prepared):
+        # Add the already encoded image to this report's document, drawImage then finds it there & skips loading it
+        doc = self.c._doc
+        reg_name = doc.getXObjectName(prepared.name)
+        if reg_name in doc.idToObject:
+            return
+
+        # Each document gets its own copy, only the encoded data is shared
+        image = copy.copy(prepared)
+        doc.Reference(image, reg_name)
+        doc.addForm(prepared.name, image)
+
+        smask = getattr(prepared, "_smask", None)
+        if smask is not None:
+            del image._smask
+            mask_name = doc.getXObjectName(smask.name)
+            if mask_name in doc.idToObject:
+                image.smask = pdfdoc.PDFObjectReference(mask_name)
+            else:
+                image.smask = doc.Reference(copy.copy(smask), mask_name)
+
+    # Set the fill colour & its opacity, within the text being drawn if it's only the colour that changes
+    def set_fill_colour(self, colour, alpha):
+        if self.state.get("fill_alpha") != alpha:
+            self.end_text()
+            self.c.setFillAlpha(alpha)
+            self.state["fill_alpha"] = alpha
+        if colour is not None and self.state.get("fill") != colour:
+            (self.text or self.c).setFillColorRGB(*colour)
+            self.state["fill"] = colour
+
+    # Write the strings drawn since the last thing that wasn't text as one text object
+    def end_text(self):
+        if self.text is not None:
+            self.c.drawText(self.text)
+            self.text = None
 
     def add_page(self):
+        self.end_text()
         self.c.showPage()
+        # Each page starts from the default state
+        self.state = {}
+
+    # Outline entry for the current page, e.g. the first page of each patient's report in a combined export
+    def add_bookmark(self, key, title, level=0):
+        self.c.bookmarkPage(key)
+        self.c.addOutlineEntry(title, key, level)
+        self.c.showOutline()
 
     def inc_page_num(self):
         self.page_num = self.page_num + 1
@@ -197,5 +515,20 @@ class ReportGenerator:
     def set_page_num(self, num: int):
         self.page_num = num
 
+    # Returns the PDF data, after writing it to the output file or stream if there is one
     def save_report(self):
-        self.c.save()
+        with span("save_report") as labels:
+            self.end_text()
+            data = finish_pdf(self.c.getpdfdata(), self.profile)
+            write_output(self.output_file, data)
+            labels["bytes"] = len(data)
+        return data
+
+
+# Write the PDF data to the path or writable stream, if there is one
+def write_output(output_file, data):
+    if hasattr(output_file, "write"):
+        output_file.write(data)
+    elif output_file is not None:
+        with open(output_file, 'wb') as file:
+            file.write(data)
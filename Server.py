@@ -0,0 +1,266 @@
+import io
+import os
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Main import escape_file_path, preload_worker, process_session, session_memory, MemoryBudget, \
+    report_export_folder, size, worker_count, memory_budget, output_profile, metrics_file, prometheus_file
+from Instrument import configure, span, update_prometheus
+
+
+# Run in the worker processes, processes the session as a normal run does (archiving its files & saving its report
+# in the export folder) & returns the PDF data of the report
+def render_session(session_folder, export_root, size):
+    output = io.BytesIO()
+    with span("session", process_cpu=True, session=session_folder), ThreadPoolExecutor(max_workers=1) as image_executor:
+        process_session(session_folder, export_root, size, output=output, image_executor=image_executor)
+    return output.getvalue()
+
+
+# Renders sessions on worker processes kept warm between requests, at most workers + max_queue at once
+# A request waits to be handed to a worker until its session's images fit in the memory budget (None for no limit)
+class RenderService:
+
+    def __init__(self, export_root, size, workers, max_queue, memory_budget=None):
+        self.export_root = export_root
+        self.size = size
+        self.capacity = workers + max_queue
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=preload_worker,
+                                            initargs=(os.path.join(export_root, "Assets", ""), output_profile))
+        self.budget = MemoryBudget(memory_budget)
+        self.lock = threading.Lock()
+        self.in_flight = set()
+        # Requests accepted but not yet handed to a worker, & of those the requests waiting for memory
+        self.accepted = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        # Seconds from each request being accepted to its report being ready, over the recent requests
+        self.latencies = deque(maxlen=1000)
+
+    # Returns the PDF data, or None if the queue is full
+    # With copy the session's files are archived from a copy made once the request is accepted, so the caller's folder
+    # is left as it was & the request can be repeated
+    def render(self, session_folder, copy=False):
+        start = time.perf_counter()
+        with self.lock:
+            if len(self.in_flight) + self.accepted >= self.capacity:
+                self.rejected += 1
+                return None
+            self.accepted += 1
+            self.waiting += 1
+
+        try:
+            memory = session_memory(session_folder)
+            self.budget.acquire(memory)
+        except BaseException:
+            with self.lock:
+                self.accepted -= 1
+            raise
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+        future = None
+        copy_folder = None
+        try:
+            # Copied only once accepted, a request turned away costs nothing
+            try:
+                if copy:
+                    copy_folder = copy_session(session_folder)
+                with self.lock:
+                    future = self.executor.submit(render_session, copy_folder or session_folder, self.export_root,
+                                                  self.size)
+                    self.in_flight.add(future)
+            finally:
+                with self.lock:
+                    self.accepted -= 1
+            data = future.result()
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+        else:
+            with self.lock:
+                self.completed += 1
+                self.latencies.append(time.perf_counter() - start)
+            return data
+        finally:
+            self.budget.release(memory)
+            with self.lock:
+                self.in_flight.discard(future)
+            if copy_folder is not None:
+                shutil.rmtree(copy_folder, ignore_errors=True)
+            update_prometheus()
+
+    def stats(self):
+        with self.lock:
+            running = sum(future.running() for future in self.in_flight)
+            latencies = sorted(self.latencies)
+            stats = {
+                "queued": len(self.in_flight) - running + self.accepted,
+                "running": running,
+                "waiting_for_memory": self.waiting,
+                "capacity": self.capacity,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+        stats["latency"] = {f"p{p}": percentile(latencies, p) for p in (50, 90, 99)}
+        stats["latency"]["max"] = latencies[-1] if latencies else None
+        return stats
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# POST /render with a JSON body {"path": <session folder>} or a zip of the session's files returns the report PDF
+# GET /stats returns the queue depth, request counts & latency percentiles in seconds
+class RenderHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_error(404)
+            return
+        self.send_body(200, "application/json", json.dumps(self.server.service.stats()).encode())
+
+    def do_POST(self):
+        if self.path != "/render":
+            self.send_error(404)
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        upload_folder = None
+        try:
+            if self.headers.get("Content-Type") == "application/zip":
+                upload_folder = extract_upload(body)
+                data = self.server.service.render(upload_folder)
+            else:
+                request = json.loads(body)
+                if not isinstance(request, dict) or not isinstance(request.get("path"), str):
+                    raise ValueError('Expected a JSON object {"path": <session folder>}.')
+                # An exported session is only read, any other session folder is copied
+                session_folder = request["path"]
+                exported = os.path.exists(os.path.join(session_folder, "files", "raw_report.pdf"))
+                data = self.server.service.render(session_folder, copy=not exported)
+        except (ValueError, zipfile.BadZipFile) as e:
+            self.send_body(422, "text/plain", str(e).encode())
+            return
+        except Exception as e:
+            self.send_body(500, "text/plain", str(e).encode())
+            return
+        finally:
+            if upload_folder is not None:
+                shutil.rmtree(upload_folder, ignore_errors=True)
+
+        if data is None:
+            self.send_body(503, "text/plain", b"Render queue is full, try again shortly.", {"Retry-After": "1"})
+        else:
+            self.send_body(200, "application/pdf", data)
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Unpack an uploaded session into a folder of its own, only the file names are kept
+def extract_upload(body):
+    upload_folder = tempfile.mkdtemp(prefix="session_")
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        for member in archive.infolist():
+            name = os.path.basename(member.filename)
+            if member.is_dir() or not name:
+                continue
+            with archive.open(member) as source, open(os.path.join(upload_folder, name), 'wb') as target:
+                shutil.copyfileobj(source, target)
+    return upload_folder
+
+
+# Copy the files of a session folder into a folder of its own
+def copy_session(session_folder):
+    if not os.path.isdir(session_folder):
+        raise ValueError(f"Session folder '{session_folder}' not found.")
+    copy_folder = tempfile.mkdtemp(prefix="session_")
+    for entry in os.scandir(session_folder):
+        if entry.is_file():
+            shutil.copy2(entry.path, copy_folder)
+    return copy_folder
+
+
+def create_server(host, port, export_root, size, workers, max_queue, memory_budget=None):
+    server = ThreadingHTTPServer((host, port), RenderHandler)
+    server.service = RenderService(export_root, size, workers, max_queue, memory_budget)
+    return server
+
+
+# Client for the service, renders the session folder & returns the PDF data
+# The folder's files are uploaded unless the service can read the folder itself
+def request_report(session_folder, url="http://127.0.0.1:8765", upload=False):
+    if upload:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for entry in os.scandir(session_folder):
+                if entry.is_file():
+                    archive.write(entry.path, entry.name)
+        body, content_type = buffer.getvalue(), "application/zip"
+    else:
+        body, content_type = json.dumps({"path": session_folder}).encode(), "application/json"
+
+    request = urllib.request.Request(url + "/render", data=body, headers={"Content-Type": content_type})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.read()
+    except urllib.error.HTTPError as e:
+        raise ValueError(f"Report request failed ({e.code}): {e.read().decode()}")
+
+
+def request_stats(url="http://127.0.0.1:8765"):
+    with urllib.request.urlopen(url + "/stats") as response:
+        return json.load(response)
+
+
+# --- CONFIG --- #
+
+# Address the service listens on, only reachable from this computer
+server_host = "127.0.0.1"
+server_port = 8765
+# Requests waiting for a worker beyond those being rendered, further requests are turned away
+max_queue = 8
+
+# --- PROGRAM --- #
+
+if __name__ == '__main__':
+
+    configure(metrics_file, prometheus_file)
+    server = create_server(server_host, server_port, escape_file_path(report_export_folder), size, worker_count,
+                           max_queue, memory_budget)
+    print(f"Rendering reports at http://{server_host}:{server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped the service.")
+    finally:
+        server.server_close()
+        server.service.close()
@@ -0,0 +1,162 @@
+import os
+import json
+import hashlib
+import functools
+
+from typing import NamedTuple
+from dataclasses import asdict
+from reportlab.lib.units import mm
+
+from Report import ReportGenerator, register_font, prepare_image, layout_paragraph
+from Instrument import span
+
+
+# Layout of the report pages, compiled into a list of draw operations once per process
+default_template = os.path.join(os.path.dirname(os.path.abspath(__file__)), "report_template.json")
+
+
+# One call to a ReportGenerator draw_ method with its position, style & any static text measurement resolved
+class DrawOp(NamedTuple):
+    draw: object
+    args: tuple
+    # Whether text arguments hold {fields} to fill in with the values of each report
+    dynamic: bool
+
+
+class ReportPlan(NamedTuple):
+    # Hash of the template the plan was compiled from
+    version: str
+    photo_page: tuple
+    uv_photo_page: tuple
+    # The operations of each report page in turn
+    pages: tuple
+
+
+# The values of a report filled into the {fields} of the template
+class ReportFields(dict):
+
+    def __init__(self, values, report, tiles):
+        super().__init__(values)
+        self.report = report
+        self.tiles = tiles
+
+    def __missing__(self, key):
+        # The page number changes as the pages are drawn & overview tiles are only cropped out once placed
+        if key == "page_num":
+            return self.report.page_num
+        if key.startswith("overview_"):
+            _, i, j = key.split("_")
+            return self.tiles.get(int(i), int(j))
+        raise KeyError(key)
+
+
+def load_template(template_file, asset_folder):
+    # Compiled again only if the template file has changed since it was last compiled
+    return compile_template(template_file, asset_folder, os.path.getmtime(template_file))
+
+
+@functools.lru_cache(maxsize=8)
+def compile_template(template_file, asset_folder, modified):
+    with open(template_file, 'rb') as file:
+        content = file.read()
+    template = json.loads(content)
+
+    styles = ReportGenerator.get_styles()
+    next_page = (DrawOp(ReportGenerator.add_page, (), False),)
+
+    photo_page = compile_ops(template["photo_page"], styles, asset_folder) + next_page
+    uv_photo_page = compile_ops(template["uv_photo_page"], styles, asset_folder) + next_page
+
+    # Every report page starts with the header & footer, the first page is numbered 1
+    header_footer = compile_block(template["header_footer"], styles, asset_folder)
+    pages = []
+    for page in template["pages"]:
+        if pages:
+            start = (*next_page, DrawOp(ReportGenerator.inc_page_num, (), False))
+        else:
+            start = (DrawOp(ReportGenerator.set_page_num, (1,), False),)
+        pages.append(start + header_footer + compile_block(page, styles, asset_folder))
+
+    return ReportPlan(hashlib.sha256(content).hexdigest(), photo_page, uv_photo_page, tuple(pages))
+
+
+# The static operations of a block are recorded once per report as a form, its fields are drawn on every page
+def compile_block(block, styles, asset_folder):
+    ops = ()
+    static = compile_ops(block.get("static", []), styles, asset_folder)
+    if any(op.dynamic for op in static):
+        raise ValueError(f"Static content of '{block['name']}' contains fields.")
+    if static:
+        ops += (DrawOp(ReportGenerator.add_static, (block["name"], functools.partial(draw_ops, static)), False),)
+    return ops + compile_ops(block.get("fields", []), styles, asset_folder)
+
+
+def compile_ops(ops, styles, asset_folder):
+    return tuple(compile_op(op, styles, asset_folder) for op in ops)
+
+
+def compile_op(op, styles, asset_folder):
+    kind = op["type"]
+    if kind == "text":
+        style = styles[op["style"]]
+        register_font(style.fontName, asset_folder)
+        # Placed using the top left corner rather than the bottom left
+        return DrawOp(ReportGenerator.draw_text, (op["x"] * mm, op["y"] * mm - style.leading, op["text"], style),
+                      "{" in op["text"])
+
+    elif kind == "para":
+        style = styles[op["style"]]
+        register_font(style.fontName, asset_folder)
+        # Paragraphs with fields can only be laid out once the values are known
+        if "{" in op["text"]:
+            return DrawOp(ReportGenerator.add_para,
+                          (op["x"], op["y"], op["width"], op["height"], op["text"], op["style"]), True)
+        para, h = layout_paragraph(op["text"], style, op["width"] * mm, op["height"] * mm)
+        return DrawOp(ReportGenerator.draw_para, (op["x"] * mm, op["y"] * mm - h, para), False)
+
+    elif kind == "image":
+        # Asset images are named relative to the asset folder, other images are given by a field such as {photo}
+        if "asset" in op:
+            file = asset_folder + op["asset"]
+            prepare_image(file)
+        else:
+            file = op["file"]
+        return DrawOp(ReportGenerator.draw_img, (op["x"] * mm, (op["y"] - op["height"]) * mm, op["width"] * mm,
+                                                 op["height"] * mm, file), "{" in file)
+
+    elif kind == "rect":
+        return DrawOp(ReportGenerator.draw_rect, (op["x"] * mm, (op["y"] - op["height"]) * mm, op["width"] * mm,
+                                                  op["height"] * mm, ReportGenerator.colours[op["colour"]],
+                                                  op["opacity"], op["fill"], op["stroke"]), False)
+
+    elif kind == "line":
+        return DrawOp(ReportGenerator.draw_line, (op["x_start"] * mm, op["x_end"] * mm, op["y_start"] * mm,
+                                                  op["y_end"] * mm, op["width"],
+                                                  ReportGenerator.colours[op["colour"]]), False)
+
+    raise ValueError(f"Unknown template operation '{kind}'.")
+
+
+# The method of each operation is looked up by name, so anything drawing like a ReportGenerator can replay the plan
+# e.g. a page preview
+def draw_ops(ops, report, fields=None):
+    for op in ops:
+        draw = getattr(report, op.draw.__name__)
+        if op.dynamic:
+            draw(*[arg.format_map(fields) if isinstance(arg, str) else arg for arg in op.args])
+        else:
+            draw(*op.args)
+
+
+# Draw a page for each photo followed by the report pages
+def render_plan(report, plan, data, images, tiles):
+    fields = ReportFields(asdict(data), report, tiles)
+
+    for image in images:
+        fields["photo"] = image.path
+        with span("render_page", page="photo", uv=image.is_uv):
+            draw_ops(plan.uv_photo_page if image.is_uv else plan.photo_page, report, fields)
+
+    for number, page in enumerate(plan.pages, 1):
+        with span("render_page", page=number):
+            draw_ops(page, report, fields)